@@ -9,6 +9,22 @@ VALID_TEXT_SYMBOLS_LETTERS = f"{VALID_UPPERCASE_LETTERS}{SPACE}{VALID_LOWERCASE_
 LEFT_PUNCTUATIONS = '('
 RIGHT_PUNCTUATIONS = ')!?.,'
 
+# Decoding is done strip by strip, the working memory it needs is about this number of bytes for each color of a strip
+DECODE_MEMORY_PER_COLOR = 24
+DEFAULT_DECODE_STRIP_COLORS = 1 << 20
+# Progressive decoding starts from a strip of this number of colors, and doubles it for each of the next strips
+FIRST_DECODE_STRIP_COLORS = 1 << 12
+# Before words are looked for, each window of this number of symbol indices is scored by the number of its indices
+# that have a common text symbol in one of the channels, and only windows with at least PRERANK_MIN_TEXT_SYMBOLS
+# of them (noise has about a third) are decoded. Hidden texts of fewer symbols than this (about 1% of the windows
+# of noise are kept) may be missed, and are only found in exhaustive mode
+PRERANK_WINDOW_SYMBOLS = 8
+PRERANK_MIN_TEXT_SYMBOLS = 7
+# Hiding is done strip by strip too (when memory is bounded), it needs about this number of bytes for each color
+HIDE_MEMORY_PER_COLOR = 16
+# The text to hide is read from its file this number of symbols at a time
+TEXT_READ_CHUNK_SIZE = 1 << 16
+
 MOST_COMMON_ENGLISH_WORDS_LOWERCASE = ["the", "of", "to", "and", "a", "in", "is", "it", "you", "that", "he", "was",
                                        "for", "on", "from", "or", "were", "which", "write", "are", "with", "as", "i",
                                        "his", "they", "be", "at", "one", "have", "this", "had", "by", "not", "word",
@@ -0,0 +1,304 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import dictionary
+import steg_decode
+import steg_detect
+import utils
+from profiling import DecodeProfile, NO_PROFILE
+
+DEFAULT_CACHE_PATH = 'steg_cache.sqlite3'
+DEFAULT_MAX_CACHE_SIZE = 1 << 30
+PIXEL_HASH_SIZE = 16
+# Seconds to wait for another process (e.g. another worker of a batch scan) that is writing to the cache
+CACHE_TIMEOUT = 30
+# The least recently used entries are evicted this many at a time, so the cache isn't evicted again on the next put
+EVICT_BATCH_SIZE = 256
+# A cache file of another version of the schema is created again (see DecodeCache.create_schema)
+CACHE_SCHEMA_VERSION = 2
+CACHE_TABLES = ('entries', 'files', 'total_size')
+CACHE_SCHEMA = (
+    """
+    CREATE TABLE entries (
+        key TEXT PRIMARY KEY,
+        pixel_hash TEXT NOT NULL,
+        value BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        last_used INTEGER NOT NULL
+    )
+    """,
+    'CREATE INDEX entries_last_used ON entries (last_used)',
+    'CREATE INDEX entries_pixel_hash ON entries (pixel_hash)',
+    """
+    CREATE TABLE files (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        pixel_hash TEXT NOT NULL
+    )
+    """,
+    # The size of all the entries together, kept by the triggers, so it is known without summing the entries
+    'CREATE TABLE total_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)',
+    'INSERT INTO total_size (id, size) VALUES (0, 0)',
+    """
+    CREATE TRIGGER entries_insert AFTER INSERT ON entries BEGIN
+        UPDATE total_size SET size = size + NEW.size;
+    END
+    """,
+    """
+    CREATE TRIGGER entries_update AFTER UPDATE OF size ON entries BEGIN
+        UPDATE total_size SET size = size + NEW.size - OLD.size;
+    END
+    """,
+    """
+    CREATE TRIGGER entries_delete AFTER DELETE ON entries BEGIN
+        UPDATE total_size SET size = size - OLD.size;
+    END
+    """,
+)
+
+
+class DecodeCache(object):
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = DEFAULT_MAX_CACHE_SIZE) -> None:
+        """
+        This class is a persistent cache of decoding results, in an SQLite file.
+        Its entries are content-addressed: they are keyed by a hash of the pixels of the image (see pixel_hash),
+        so an image that was copied, renamed or saved again with other PNG filters is found in it too.
+        The PNG file of each image is remembered with its size and modification time, so an unchanged file
+        is found without reading it at all (see file_pixel_hash).
+        When the entries are bigger than max_size bytes, the least recently used ones are evicted.
+        The file can be shared by many processes (e.g. the workers of a batch scan).
+        """
+        self.path = path
+        self.max_size = max_size
+        self.connection = sqlite3.connect(path, timeout=CACHE_TIMEOUT, isolation_level=None)
+        # Readers don't block the writer (and the other way around)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.create_schema()
+
+    def create_schema(self) -> None:
+        """
+        Creates the tables of the cache, if the file doesn't have them in the current version of the schema
+        (the entries of an older version are dropped, it is only a cache).
+        It is done in a single transaction, so the workers of a scan that open a new cache at once don't race.
+        """
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != CACHE_SCHEMA_VERSION:
+                for table in CACHE_TABLES:
+                    self.connection.execute(f'DROP TABLE IF EXISTS {table}')
+                for statement in CACHE_SCHEMA:
+                    self.connection.execute(statement)
+                self.connection.execute(f'PRAGMA user_version = {CACHE_SCHEMA_VERSION}')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def get(self, key: str) -> bytes or None:
+        """
+        Returns the value of the given key (and marks it as used now), or None if it isn't in the cache.
+        """
+        row = self.connection.execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time_ns(), key))
+        return row[0]
+
+    def put(self, key: str, value: bytes, pixel_hash_of_image: str) -> None:
+        """
+        Puts the value of the given key, of the image with the given pixel hash, in the cache.
+        The cache is evicted only when it gets bigger than max_size bytes.
+        """
+        self.connection.execute('INSERT INTO entries (key, pixel_hash, value, size, last_used) VALUES (?, ?, ?, ?, ?) '
+                                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, '
+                                'last_used = excluded.last_used',
+                                (key, pixel_hash_of_image, value, len(value), time.time_ns()))
+        if self.size() > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used entries, EVICT_BATCH_SIZE at a time, until all the entries together are
+        at most max_size bytes, and forgets the files of the images that have no entries left.
+        """
+        if self.size() <= self.max_size:
+            return
+        while self.size() > self.max_size:
+            self.connection.execute('DELETE FROM entries WHERE key IN ('
+                                    'SELECT key FROM entries ORDER BY last_used, key LIMIT ?)', (EVICT_BATCH_SIZE,))
+        self.connection.execute('DELETE FROM files WHERE NOT EXISTS ('
+                                'SELECT 1 FROM entries WHERE entries.pixel_hash = files.pixel_hash)')
+
+    def size(self) -> int:
+        """
+        Returns the number of bytes of all the entries.
+        """
+        return self.connection.execute('SELECT size FROM total_size').fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def file_pixel_hash(self, file_path: str) -> str or None:
+        """
+        Returns the pixel hash of the image saved in the given file, if the file wasn't changed since it was
+        remembered (see remember_file), without reading it. Returns None otherwise.
+        """
+        stat = os.stat(file_path)
+        row = self.connection.execute('SELECT size, mtime_ns, pixel_hash FROM files WHERE path = ?',
+                                      (os.path.abspath(file_path),)).fetchone()
+        if row is None or row[:2] != (stat.st_size, stat.st_mtime_ns):
+            return None
+        return row[2]
+
+    def remember_file(self, file_path: str, pixel_hash_of_file: str) -> None:
+        stat = os.stat(file_path)
+        self.connection.execute('INSERT OR REPLACE INTO files (path, size, mtime_ns, pixel_hash) VALUES (?, ?, ?, ?)',
+                                (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, pixel_hash_of_file))
+
+    def clear(self) -> None:
+        self.connection.execute('DELETE FROM entries')
+        self.connection.execute('DELETE FROM files')
+        self.connection.execute('VACUUM')
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'DecodeCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def pixel_hash(image_as_np_array: np.ndarray) -> str:
+    """
+    This function returns a fast hash of the pixels of the image (and its shape, so an RGB image and an RGBA image
+    with the same bytes don't have the same hash).
+    """
+    digest = hashlib.blake2b(digest_size=PIXEL_HASH_SIZE)
+    digest.update(str(image_as_np_array.shape).encode('ascii'))
+    digest.update(np.ascontiguousarray(image_as_np_array))
+    return digest.hexdigest()
+
+
+def text_key(pixel_hash_of_image: str, prerank: bool = True) -> str:
+    """
+    The key of the decoded text of an image. The text depends on the decoder and on the dictionary too,
+    so texts that were decoded by another version of the decoder or with another dictionary aren't reused,
+    and on whether the image was decoded in exhaustive mode (without prerank, see steg_decode.decode_strips).
+    """
+    mode = 'text' if prerank else 'exhaustive-text'
+    return f"{mode}:{steg_decode.DECODER_VERSION}:{dictionary.english_dictionary.fingerprint}:{pixel_hash_of_image}"
+
+
+def detection_key(pixel_hash_of_image: str) -> str:
+    """
+    The key of the detection of a payload in an image (see steg_detect.detect). The detection depends on the
+    detector, and on the decoder too (it looks for text the way the decoder pre-ranks it).
+    """
+    return f"detection:{steg_detect.DETECTOR_VERSION}:{steg_decode.DECODER_VERSION}:{pixel_hash_of_image}"
+
+
+def cached_scan_png_file(png_file_path: str, cache: DecodeCache, detect_threshold: float = None,
+                         profile: DecodeProfile = NO_PROFILE, progressive: bool = True, prerank: bool = True) -> dict:
+    """
+    This function scans the image saved in the given PNG file (see steg_batch.scan), unless its results are in the
+    cache already: if the file wasn't changed since it was scanned, its results are found without reading it at all,
+    otherwise the image is loaded and hashed (once), and its results are looked up by the hash of its pixels.
+    If detect_threshold is given, the image is checked for a payload first (see steg_detect.detect), and decoded
+    (like steg_decode.decode_png_image) only if it is at least this likely to carry one.
+    :return: A dict with the probability, payload_bytes and flagged of the detection (if detect_threshold is given),
+    the guess (if the image was decoded), and whether all of them were found in the cache.
+    """
+    result = {'cached': True}
+    image_as_np_array = None
+    pixel_hash_of_image = cache.file_pixel_hash(png_file_path)
+
+    def load_image() -> np.ndarray:
+        nonlocal image_as_np_array, pixel_hash_of_image
+        if image_as_np_array is None:
+            start_time = profile.clock()
+            image_as_np_array = utils.png_file_to_np_array(png_file_path)
+            profile.record('load', start_time, colors=image_as_np_array.size)
+            start_time = profile.clock()
+            pixel_hash_of_image = pixel_hash(image_as_np_array)
+            profile.record('hash', start_time, colors=image_as_np_array.size)
+        return image_as_np_array
+
+    if pixel_hash_of_image is None:
+        load_image()
+    if detect_threshold is not None:
+        key = detection_key(pixel_hash_of_image)
+        detection = cache.get(key)
+        if detection is None:
+            detection = steg_detect.detect(load_image())
+            detection = {'probability': detection['probability'], 'payload_bytes': detection['payload_bytes']}
+            cache.put(key, json.dumps(detection).encode('utf-8'), pixel_hash_of_image)
+            result['cached'] = False
+        else:
+            detection = json.loads(detection)
+        result.update(detection, flagged=detection['probability'] >= detect_threshold)
+    if result.get('flagged', True):
+        key = text_key(pixel_hash_of_image, prerank)
+        text = cache.get(key)
+        if text is None:
+            text = steg_decode.decode_png_image(load_image(), profile, progressive, prerank)
+            cache.put(key, text.encode('utf-8'), pixel_hash_of_image)
+            result['cached'] = False
+        else:
+            text = text.decode('utf-8')
+        result['guess'] = text
+    if image_as_np_array is not None:
+        cache.remember_file(png_file_path, pixel_hash_of_image)
+    return result
+
+
+def cached_decode_png_file(png_file_path: str, cache: DecodeCache, profile: DecodeProfile = NO_PROFILE,
+                           progressive: bool = True, prerank: bool = True) -> (str, bool):
+    """
+    This function decodes the image saved in the given PNG file like steg_decode.decode_png_file,
+    unless its text is in the cache already (see cached_scan_png_file).
+    :return: The text, and whether it was found in the cache.
+    """
+    result = cached_scan_png_file(png_file_path, cache, profile=profile, progressive=progressive, prerank=prerank)
+    return result['guess'], result['cached']
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program, and shows or clears the cache.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--cache',
+                        type=str,
+                        default=DEFAULT_CACHE_PATH,
+                        help=f'Path of the cache file (default: {DEFAULT_CACHE_PATH}).')
+    parser.add_argument('--clear',
+                        action='store_true',
+                        help='Delete all the entries of the cache.')
+    parser.add_argument('--max-size',
+                        type=utils.parse_memory_size,
+                        help='Evict the least recently used entries until the cache is at most this size (e.g. 512M).')
+
+    args = parser.parse_args()
+    with DecodeCache(args.cache) as cache:
+        if args.clear:
+            cache.clear()
+        if args.max_size is not None:
+            cache.max_size = args.max_size
+            cache.evict()
+        print(f"The cache {args.cache} has {len(cache)} entries, of {cache.size()} bytes.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import functools
+import hashlib
+import struct
+
+import numpy as np
+
+import config
+
+COMPACT_FILE_MAGIC = b'STEGDICT'
+COMPACT_FILE_VERSION = 1
+COMPACT_FILE_HEADER = struct.Struct('<8sIII')  # magic, version, number of words, bytes of each word
+NOT_FOUND = -1
+
+
+class EnglishDictionary(object):
+
+    def __init__(self, sorted_words: np.ndarray, ranks: np.ndarray) -> None:
+        """
+        This class is an index of a list of English words, for looking words up without scanning the list.
+        The words are kept sorted in a fixed width bytes array, so many words are looked up at once by binary
+        search, and the array can be memory-mapped from a file (see save and load) instead of loaded.
+        :param sorted_words: The lowercase words, sorted, as a np array of fixed width bytes.
+        :param ranks: The position of each of the sorted words in the original list (lower is more common).
+        """
+        self.sorted_words = sorted_words
+        self.ranks = ranks
+        self.max_word_length = sorted_words.dtype.itemsize if len(sorted_words) else 0
+
+    @classmethod
+    def from_words(cls, words: [str]) -> 'EnglishDictionary':
+        """
+        Builds the index of the given words, which are ordered from the most common one.
+        Words that can't be hidden as text (not only English letters) are left out, they can never be found.
+        """
+        ranks_of_words = {}
+        for rank, word in enumerate(words):
+            word = word.strip().lower()
+            if word.isascii() and word.isalpha() and word not in ranks_of_words:
+                ranks_of_words[word] = rank
+        sorted_words = sorted(ranks_of_words)
+        width = max((len(word) for word in sorted_words), default=1)
+        return cls(np.array([word.encode('ascii') for word in sorted_words], dtype=f'S{width}'),
+                   np.array([ranks_of_words[word] for word in sorted_words], dtype=np.uint32))
+
+    @classmethod
+    def from_wordlist_file(cls, wordlist_path: str) -> 'EnglishDictionary':
+        """
+        Loads a wordlist: either a compact dictionary file (see save), which is memory-mapped,
+        or a TXT file with a word in each line (ordered from the most common one).
+        """
+        with open(wordlist_path, 'rb') as file:
+            is_compact = file.read(len(COMPACT_FILE_MAGIC)) == COMPACT_FILE_MAGIC
+        if is_compact:
+            return cls.load(wordlist_path)
+        with open(wordlist_path, 'r', encoding='utf-8', errors='ignore') as file:
+            return cls.from_words(file.read().split())
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index as a compact file: a header, the sorted words and their ranks.
+        """
+        with open(path, 'wb') as file:
+            file.write(COMPACT_FILE_HEADER.pack(COMPACT_FILE_MAGIC, COMPACT_FILE_VERSION, len(self.sorted_words),
+                                                self.sorted_words.dtype.itemsize))
+            file.write(self.sorted_words.tobytes())
+            file.write(self.ranks.astype('<u4').tobytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'EnglishDictionary':
+        """
+        Memory-maps a compact file saved by save, so only the pages the binary search touches are read.
+        """
+        with open(path, 'rb') as file:
+            magic, version, num_of_words, width = COMPACT_FILE_HEADER.unpack(file.read(COMPACT_FILE_HEADER.size))
+        if magic != COMPACT_FILE_MAGIC or version != COMPACT_FILE_VERSION:
+            raise ValueError(f"{path} is not a compact dictionary file of version {COMPACT_FILE_VERSION}.")
+        sorted_words = np.memmap(path, dtype=f'S{width}', mode='r', offset=COMPACT_FILE_HEADER.size,
+                                 shape=(num_of_words,))
+        ranks = np.memmap(path, dtype='<u4', mode='r', offset=COMPACT_FILE_HEADER.size + num_of_words * width,
+                          shape=(num_of_words,))
+        return cls(sorted_words, ranks)
+
+    def ranks_of(self, words: [str] or np.ndarray) -> np.ndarray:
+        """
+        Looks up many lowercase words at once.
+        :param words: ascii words (str or bytes).
+        :return: The rank of each word, or NOT_FOUND for words that aren't in the dictionary.
+        """
+        if not len(words) or not len(self.sorted_words):
+            return np.full(len(words), NOT_FOUND, dtype=np.int64)
+        words = np.asarray(words)
+        if words.dtype.kind == 'U':
+            words = words.astype('S')
+        # Words longer than the longest word in the dictionary can't be found in it
+        fits = np.char.str_len(words) <= self.max_word_length
+        words = words.astype(self.sorted_words.dtype)
+        indices = np.minimum(np.searchsorted(self.sorted_words, words), len(self.sorted_words) - 1)
+        found = fits & (self.sorted_words[indices] == words)
+        return np.where(found, self.ranks[indices].astype(np.int64), NOT_FOUND)
+
+    def rank_of(self, word: str) -> int:
+        """
+        Looks up a single lowercase word.
+        :return: Its rank, or NOT_FOUND if it isn't in the dictionary.
+        """
+        if not word or len(word) > self.max_word_length or not word.isascii():
+            return NOT_FOUND
+        return int(self.ranks_of([word.encode('ascii')])[0])
+
+    @functools.cached_property
+    def fingerprint(self) -> str:
+        """
+        A hash of the words and their ranks, which changes whenever the dictionary does
+        (e.g. so results that were decoded with another dictionary aren't reused, see decode_cache.py).
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(self.sorted_words.dtype).encode('ascii'))
+        digest.update(np.ascontiguousarray(self.sorted_words))
+        digest.update(np.ascontiguousarray(self.ranks, dtype='<u4'))
+        return digest.hexdigest()
+
+    def __contains__(self, word: str) -> bool:
+        return self.rank_of(word) != NOT_FOUND
+
+
+# Built once, when the module is imported
+english_dictionary = EnglishDictionary.from_words(config.MOST_COMMON_ENGLISH_WORDS_LOWERCASE)
+# Path of the wordlist the dictionary was loaded from (see use_wordlist), None for the most common English words
+wordlist_path = None
+
+
+def use_wordlist(path: str) -> None:
+    """
+    Replaces the dictionary of the most common English words (of config.py) with the given wordlist
+    (see EnglishDictionary.from_wordlist_file).
+    """
+    global english_dictionary, wordlist_path
+    english_dictionary = EnglishDictionary.from_wordlist_file(path)
+    wordlist_path = path
+
+
+def main() -> None:
+    """
+    The main function
+    It converts a TXT wordlist to a compact dictionary file, which is memory-mapped when it is used.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--wordlist',
+                        type=str,
+                        help='Path of a TXT file with a word in each line, from the most common one.',
+                        required=True)
+    parser.add_argument('--output',
+                        type=str,
+                        help='Path for saving the compact dictionary file.',
+                        required=True)
+
+    args = parser.parse_args()
+    dictionary = EnglishDictionary.from_wordlist_file(args.wordlist)
+    dictionary.save(args.output)
+    print(f'{len(dictionary.sorted_words)} words were saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
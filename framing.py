@@ -0,0 +1,419 @@
+import hashlib
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+from config import NUM_OF_BITS_IN_ASCII_SYMBOL, MAX_HIDE_CHANNELS
+
+FRAME_MAGIC = b'STEG'
+FRAME_VERSION = 1
+# magic, version, flags, bits per channel, color channels, payload length, payload CRC-32
+FRAME_HEADER_FIELDS = struct.Struct('>4sBBBBII')
+FRAME_HEADER_CRC = struct.Struct('>I')
+FRAME_HEADER_SIZE = FRAME_HEADER_FIELDS.size + FRAME_HEADER_CRC.size
+FRAME_HEADER_COLORS = FRAME_HEADER_SIZE * NUM_OF_BITS_IN_ASCII_SYMBOL
+# The color channels of a pixel, and their bits in the mask of the color channels the payload is hidden in
+COLOR_CHANNELS_NAMES = 'RGBA'
+RGB_COLOR_CHANNELS = 0b0111
+ALPHA_COLOR_CHANNEL = 0b1000
+NUM_OF_RGB_CHANNELS = 3
+# Flags of the header: how the payload was compressed before it was hidden (at most one of them is set)
+FLAG_ZLIB = 0b001
+FLAG_LZMA = 0b010
+COMPRESSION_FLAGS_MASK = FLAG_ZLIB | FLAG_LZMA
+# The payload is a shard of a payload that is split over several images (see split_payload)
+FLAG_SHARD = 0b100
+SUPPORTED_FLAGS = COMPRESSION_FLAGS_MASK | FLAG_SHARD
+COMPRESSION_FLAGS = {'zlib': FLAG_ZLIB, 'lzma': FLAG_LZMA}
+# The payload is compressed to raw streams, without their own headers and checksums, the header has them already
+ZLIB_WBITS = -zlib.MAX_WBITS
+LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': lzma.PRESET_DEFAULT}]
+# A shard starts with: the id of the whole payload, its index, the number of shards,
+# and the length and CRC-32 of the whole payload
+PAYLOAD_ID_SIZE = 8
+SHARD_HEADER = struct.Struct(f'>{PAYLOAD_ID_SIZE}sHHII')
+MAX_SHARDS = (1 << 16) - 1
+
+
+class InvalidFrameError(Exception):
+    """
+    Raised when the image has no framed payload, or its framed payload is corrupted.
+    """
+
+
+class ShardedPayloadError(Exception):
+    """
+    Raised when the framed payload of an image is only a shard of a payload that is split over several images,
+    so it can't be decoded alone.
+    """
+
+
+class FrameHeader(object):
+
+    def __init__(self, payload_length: int, payload_crc: int, flags: int = 0, bits_per_channel: int = 1,
+                 color_channels: int = RGB_COLOR_CHANNELS) -> None:
+        """
+        This class represents the header of a framed payload, that is hidden before the payload itself.
+        With the header, the decoder knows exactly where the payload is and how long it is,
+        instead of guessing it, and can verify it with its checksum.
+        :param payload_length: Number of bytes of the payload.
+        :param payload_crc: CRC-32 of the payload.
+        :param flags: Bits that describe how the payload is encoded (FLAG_ZLIB or FLAG_LZMA if it is compressed,
+        and FLAG_SHARD if it is a shard).
+        :param bits_per_channel: Number of Least Significant Bits of each color the payload is hidden in (1-3).
+        :param color_channels: Bit mask of the colors of each pixel (R is bit 0, G is bit 1, B is bit 2,
+        A is bit 3) the payload is hidden in.
+        """
+        self.payload_length = payload_length
+        self.payload_crc = payload_crc
+        self.flags = flags
+        self.bits_per_channel = bits_per_channel
+        self.color_channels = color_channels
+
+    @property
+    def num_of_carriers(self) -> int:
+        """
+        Number of colors the payload is hidden in.
+        """
+        return -(-self.payload_length * NUM_OF_BITS_IN_ASCII_SYMBOL // self.bits_per_channel)
+
+    @property
+    def num_of_image_channels(self) -> int:
+        """
+        Number of channels of each pixel the image has to be read with: RGBA if the payload is hidden
+        in the alpha channel too, RGB otherwise.
+        """
+        return len(COLOR_CHANNELS_NAMES) if self.color_channels & ALPHA_COLOR_CHANNEL else NUM_OF_RGB_CHANNELS
+
+    def num_of_colors(self, num_of_channels: int = None) -> int:
+        """
+        Number of colors from the start of the image to the end of the payload,
+        when the image is read with num_of_channels channels of each pixel (num_of_image_channels by default).
+        """
+        num_of_channels = num_of_channels or self.num_of_image_channels
+        return colors_span(self.color_channels, num_of_channels, first_carrier_color(num_of_channels),
+                           self.num_of_carriers)
+
+    def to_bytes(self) -> bytes:
+        fields = FRAME_HEADER_FIELDS.pack(FRAME_MAGIC, FRAME_VERSION, self.flags, self.bits_per_channel,
+                                          self.color_channels, self.payload_length, self.payload_crc)
+        return fields + FRAME_HEADER_CRC.pack(zlib.crc32(fields))
+
+    @classmethod
+    def from_bytes(cls, header: bytes) -> 'FrameHeader':
+        """
+        Parses and verifies a header.
+        :raise InvalidFrameError: If the bytes are not a valid header.
+        """
+        fields = header[:FRAME_HEADER_FIELDS.size]
+        (header_crc,) = FRAME_HEADER_CRC.unpack_from(header, FRAME_HEADER_FIELDS.size)
+        magic, version, flags, bits_per_channel, color_channels, payload_length, payload_crc = \
+            FRAME_HEADER_FIELDS.unpack(fields)
+        if magic != FRAME_MAGIC or zlib.crc32(fields) != header_crc:
+            raise InvalidFrameError("The image has no framed payload.")
+        if version != FRAME_VERSION:
+            raise InvalidFrameError(f"The framed payload is of version {version}, only version {FRAME_VERSION} "
+                                    f"is supported.")
+        if not 1 <= bits_per_channel <= MAX_HIDE_CHANNELS or not 0 < color_channels < 1 << len(COLOR_CHANNELS_NAMES):
+            raise InvalidFrameError("The layout of the framed payload is not valid.")
+        if flags & ~SUPPORTED_FLAGS or flags & COMPRESSION_FLAGS_MASK == COMPRESSION_FLAGS_MASK:
+            raise InvalidFrameError(f"The framed payload is encoded with unsupported flags ({flags:#x}).")
+        return cls(payload_length, payload_crc, flags, bits_per_channel, color_channels)
+
+
+def payload_header(payload: bytes, flags: int = 0, bits_per_channel: int = 1,
+                   color_channels: int = RGB_COLOR_CHANNELS) -> FrameHeader:
+    """
+    This function returns the header of the given payload, that is hidden before it.
+    """
+    return FrameHeader(len(payload), zlib.crc32(payload), flags, bits_per_channel, color_channels)
+
+
+def compression_flags(compression: str = None) -> int:
+    """
+    This function converts the name of a compression ('zlib' or 'lzma', or None for no compression)
+    to the flags of the header.
+    """
+    if not compression:
+        return 0
+    if compression not in COMPRESSION_FLAGS:
+        raise ValueError(f"The compression must be one of {', '.join(COMPRESSION_FLAGS)}, not '{compression}'.")
+    return COMPRESSION_FLAGS[compression]
+
+
+def compress_payload_chunks(payload_chunks: [bytes], flags: int = 0) -> [bytes]:
+    """
+    This function compresses the payload as the flags say (or yields it as is, if they say nothing),
+    chunk by chunk, so a long payload doesn't have to be in memory.
+    """
+    if flags & FLAG_ZLIB:
+        compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zlib.DEFLATED, ZLIB_WBITS)
+    elif flags & FLAG_LZMA:
+        compressor = lzma.LZMACompressor(lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    else:
+        yield from payload_chunks
+        return
+    for chunk in payload_chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+
+def decompress_payload(payload: bytes, flags: int = 0) -> bytes:
+    """
+    This function reverses compress_payload_chunks.
+    :raise InvalidFrameError: If the payload can't be decompressed.
+    """
+    try:
+        if flags & FLAG_ZLIB:
+            return zlib.decompress(payload, ZLIB_WBITS)
+        if flags & FLAG_LZMA:
+            return lzma.decompress(payload, lzma.FORMAT_RAW, filters=LZMA_FILTERS)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise InvalidFrameError(f"The framed payload can't be decompressed: {e}") from None
+    return payload
+
+
+class ShardHeader(object):
+
+    def __init__(self, payload_id: bytes, index: int, num_of_shards: int, payload_length: int,
+                 payload_crc: int) -> None:
+        """
+        This class represents the header of a shard, that is hidden at the start of its framed payload.
+        With it, the shards of a payload are put back together in any order they are found in,
+        and shards of other payloads aren't mixed with them.
+        :param payload_id: A hash of the whole payload (see split_payload).
+        :param index: The index of the shard in the payload (from 0).
+        """
+        self.payload_id = payload_id
+        self.index = index
+        self.num_of_shards = num_of_shards
+        self.payload_length = payload_length
+        self.payload_crc = payload_crc
+
+    def to_bytes(self) -> bytes:
+        return SHARD_HEADER.pack(self.payload_id, self.index, self.num_of_shards, self.payload_length,
+                                 self.payload_crc)
+
+    @classmethod
+    def from_bytes(cls, shard: bytes) -> 'ShardHeader':
+        """
+        :raise InvalidFrameError: If the bytes are too short for a shard header, or it isn't valid.
+        """
+        if len(shard) < SHARD_HEADER.size:
+            raise InvalidFrameError("The shard is shorter than its header.")
+        header = cls(*SHARD_HEADER.unpack_from(shard))
+        if not header.index < header.num_of_shards:
+            raise InvalidFrameError(f"The shard is of index {header.index}, of only {header.num_of_shards} shards.")
+        return header
+
+
+def split_payload(payload: bytes, shard_sizes: [int]) -> [bytes]:
+    """
+    This function splits the payload to shards of the given sizes (their sum is the size of the payload),
+    each with a shard header before it, to hide each of them (framed) in another image.
+    """
+    if len(shard_sizes) > MAX_SHARDS:
+        raise ValueError(f"A payload can be split to at most {MAX_SHARDS} shards.")
+    payload_id = hashlib.blake2b(payload, digest_size=PAYLOAD_ID_SIZE).digest()
+    payload_crc = zlib.crc32(payload)
+    shards = []
+    start = 0
+    for index, size in enumerate(shard_sizes):
+        header = ShardHeader(payload_id, index, len(shard_sizes), len(payload), payload_crc)
+        shards.append(header.to_bytes() + payload[start:start + size])
+        start += size
+    return shards
+
+
+def join_shards(shards: [bytes]) -> bytes:
+    """
+    This function puts the payload back together from its shards (see split_payload), given in any order.
+    :raise InvalidFrameError: If shards are missing, or they are of different payloads, or the payload doesn't
+    match its checksum.
+    """
+    shards_of_payloads = {}
+    for shard in shards:
+        header = ShardHeader.from_bytes(shard)
+        shards_of_payloads.setdefault(header.payload_id, {})[header.index] = (header, shard[SHARD_HEADER.size:])
+    if len(shards_of_payloads) != 1:
+        raise InvalidFrameError(f"The shards are of {len(shards_of_payloads)} payloads, not of a single one.")
+    (shards_of_payload,) = shards_of_payloads.values()
+    header, _ = next(iter(shards_of_payload.values()))
+    missing = [index + 1 for index in range(header.num_of_shards) if index not in shards_of_payload]
+    if missing:
+        raise InvalidFrameError(f"Shards {missing} of the {header.num_of_shards} shards of the payload are missing.")
+    payload = b''.join(shards_of_payload[index][1] for index in range(header.num_of_shards))
+    if len(payload) != header.payload_length or zlib.crc32(payload) != header.payload_crc:
+        raise InvalidFrameError("The payload that was put together from its shards doesn't match its checksum.")
+    return payload
+
+
+def parse_color_channels(names: str) -> int:
+    """
+    This function converts the names of color channels (e.g. 'RGB', 'rb', 'GA') to their bit mask.
+    """
+    names = names.upper()
+    if not names or any(name not in COLOR_CHANNELS_NAMES for name in names):
+        raise ValueError(f"The color channels must be some of {COLOR_CHANNELS_NAMES}, not '{names}'.")
+    return sum(1 << COLOR_CHANNELS_NAMES.index(name) for name in set(names))
+
+
+def first_carrier_color(num_of_channels: int) -> int:
+    """
+    The header is hidden in the LSB of the RGB colors of the first pixels, and the payload right after it.
+    This function returns the index of the first color after the header, when the image is read with
+    num_of_channels channels of each pixel.
+    """
+    num_of_pixels, num_of_colors_left = divmod(FRAME_HEADER_COLORS, NUM_OF_RGB_CHANNELS)
+    return num_of_pixels * num_of_channels + num_of_colors_left
+
+
+def channel_offsets(color_channels: int, num_of_channels: int, start: int) -> np.ndarray:
+    """
+    This function returns the offsets of the colors of the given color channels in each pixel,
+    counting from the color of index start.
+    """
+    return np.array([offset for offset in range(num_of_channels)
+                     if color_channels >> ((start + offset) % num_of_channels) & 1])
+
+
+def colors_selector(color_channels: int, num_of_channels: int, start: int, first_index: int, num_of_colors: int,
+                    first_color: int = 0) -> slice or np.ndarray:
+    """
+    Both the header and the payload are hidden in the sequence of the colors of some color channels,
+    from some color on (e.g. the payload in the colors of the R and B channels, after the header),
+    so the same pixels and channels are used whether the image is read as RGB or as RGBA.
+    This function selects colors number first_index to first_index + num_of_colors of such a sequence
+    out of the colors of the image from first_color on (e.g. a strip of the image).
+    It returns a slice if the sequence is of all the channels, so they are selected without copying them.
+    :param color_channels: Bit mask of the color channels of the sequence.
+    :param num_of_channels: Number of channels of each pixel the image is read with (3 for RGB, 4 for RGBA).
+    :param start: Index of the color the sequence starts from.
+    """
+    offsets = channel_offsets(color_channels, num_of_channels, start)
+    if offsets.size == num_of_channels:
+        return slice(start + first_index - first_color, start + first_index + num_of_colors - first_color)
+    indices = np.arange(first_index, first_index + num_of_colors)
+    return start + indices // offsets.size * num_of_channels + offsets[indices % offsets.size] - first_color
+
+
+def num_of_colors_before(color_channels: int, num_of_channels: int, start: int, color_index: int) -> int:
+    """
+    This function returns the number of colors of the sequence (see colors_selector)
+    before the color of the given index.
+    """
+    if color_index <= start:
+        return 0
+    offsets = channel_offsets(color_channels, num_of_channels, start)
+    num_of_pixels, num_of_colors_left = divmod(color_index - start, num_of_channels)
+    return num_of_pixels * offsets.size + int(np.count_nonzero(offsets < num_of_colors_left))
+
+
+def colors_span(color_channels: int, num_of_channels: int, start: int, num_of_colors: int) -> int:
+    """
+    This function returns the number of colors from the start of the image to the end of the
+    first num_of_colors colors of the sequence (see colors_selector).
+    """
+    if not num_of_colors:
+        return start
+    offsets = channel_offsets(color_channels, num_of_channels, start)
+    num_of_pixels, num_of_colors_left = divmod(num_of_colors - 1, offsets.size)
+    return start + num_of_pixels * num_of_channels + int(offsets[num_of_colors_left]) + 1
+
+
+def bits_to_carrier_values(bits: np.ndarray, bits_per_channel: int) -> np.ndarray:
+    """
+    This function groups the bits to the values of the carriers, bits_per_channel bits in each carrier
+    (the first bit of a group is the most significant bit of its value). The last group is padded with zeros.
+    """
+    if bits_per_channel == 1:
+        return bits
+    bits = np.concatenate((bits, np.zeros(-bits.size % bits_per_channel, dtype=np.uint8)))
+    shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+    return np.bitwise_or.reduce(bits.reshape(-1, bits_per_channel) << shifts, axis=1).astype(np.uint8)
+
+
+def carrier_values_to_bits(values: np.ndarray, bits_per_channel: int) -> np.ndarray:
+    """
+    This function reverses bits_to_carrier_values (of the carriers, only their lowest bits_per_channel bits are read).
+    """
+    shifts = np.arange(bits_per_channel - 1, -1, -1, dtype=np.uint8)
+    return ((values[:, None] >> shifts) & np.uint8(1)).reshape(-1)
+
+
+class ColorsReader(object):
+
+    def __init__(self, row_strips: [np.ndarray]) -> None:
+        """
+        This class reads the colors of an image that is given strip by strip (in any shape),
+        only as far as they are needed.
+        """
+        self.row_strips = iter(row_strips)
+        self.pending = np.empty(0, dtype=np.uint8)
+
+    def read(self, num_of_colors: int) -> np.ndarray:
+        """
+        Returns the next num_of_colors colors (or fewer, if the image ends before).
+        """
+        parts = [self.pending] if self.pending.size else []
+        num_of_read_colors = self.pending.size
+        while num_of_read_colors < num_of_colors:
+            row_strip = next(self.row_strips, None)
+            if row_strip is None:
+                break
+            parts.append(row_strip.reshape(-1))
+            num_of_read_colors += parts[-1].size
+        # A single part (e.g. an image that is given as one strip) is sliced without copying it
+        colors = parts[0] if len(parts) == 1 else np.concatenate(parts or [self.pending])
+        self.pending = colors[num_of_colors:]
+        return colors[:num_of_colors]
+
+
+def read_header(reader: ColorsReader, num_of_channels: int) -> FrameHeader:
+    """
+    This function reads the header, that was hidden in the LSB of the RGB colors of the first pixels.
+    :raise InvalidFrameError: If there is no framed payload in the image.
+    """
+    colors = reader.read(first_carrier_color(num_of_channels))
+    if colors.size < first_carrier_color(num_of_channels):
+        raise InvalidFrameError("The image ends before the end of the framed payload.")
+    colors = colors[colors_selector(RGB_COLOR_CHANNELS, num_of_channels, 0, 0, FRAME_HEADER_COLORS)]
+    return FrameHeader.from_bytes(np.packbits(colors & np.uint8(1)).tobytes())
+
+
+def read_frame_header(row_strips: [np.ndarray], num_of_channels: int = NUM_OF_RGB_CHANNELS) -> FrameHeader:
+    """
+    This function reads only the header of the framed payload that was hidden in the image (see read_frame).
+    :raise InvalidFrameError: If there is no framed payload in the image.
+    """
+    return read_header(ColorsReader(row_strips), num_of_channels)
+
+
+def read_frame(row_strips: [np.ndarray], num_of_channels: int = NUM_OF_RGB_CHANNELS) -> (FrameHeader, bytes):
+    """
+    This function reads the framed payload that was hidden in the image, which is given strip by strip
+    (with num_of_channels channels of each pixel).
+    The header is always hidden in the LSB of the RGB colors of the first pixels, and the payload after it
+    (see colors_selector).
+    Only the strips of the header and the payload are read, so it takes time proportional to the payload only.
+    :raise InvalidFrameError: If there is no framed payload in the image, or it doesn't match its checksum.
+    """
+    reader = ColorsReader(row_strips)
+    header = read_header(reader, num_of_channels)
+    if header.num_of_image_channels > num_of_channels:
+        raise InvalidFrameError("The framed payload is hidden in the alpha channel, which the image was read without.")
+    first_color = first_carrier_color(num_of_channels)
+    colors = reader.read(header.num_of_colors(num_of_channels) - first_color)
+    if colors.size < header.num_of_colors(num_of_channels) - first_color:
+        raise InvalidFrameError("The image ends before the end of the framed payload.")
+    carriers = colors[colors_selector(header.color_channels, num_of_channels, first_color, 0, header.num_of_carriers,
+                                      first_color)]
+    bits = carrier_values_to_bits(carriers, header.bits_per_channel)
+    payload = np.packbits(bits[:header.payload_length * NUM_OF_BITS_IN_ASCII_SYMBOL]).tobytes()
+    if zlib.crc32(payload) != header.payload_crc:
+        raise InvalidFrameError("The framed payload doesn't match its checksum.")
+    return header, payload
@@ -0,0 +1,299 @@
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+READ_CHUNK_SIZE = 1 << 16
+# Maximal size of the data of each IDAT chunk that is written
+WRITE_CHUNK_SIZE = 1 << 16
+
+# PNG color types, and the number of bytes of each of their pixels (for 8 bits samples)
+GRAYSCALE = 0
+TRUECOLOR = 2
+INDEXED = 3
+GRAYSCALE_ALPHA = 4
+TRUECOLOR_ALPHA = 6
+BYTES_PER_PIXEL = {GRAYSCALE: 1, TRUECOLOR: 3, INDEXED: 1, GRAYSCALE_ALPHA: 2, TRUECOLOR_ALPHA: 4}
+# The Pillow mode of the bytes of pixels of each size, to unfilter the rows with its PNG decoder
+RAW_MODES = {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}
+
+# PNG filter types of a row
+FILTER_NONE = 0
+FILTER_SUB = 1
+FILTER_UP = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH = 4
+
+
+class UnsupportedPngError(Exception):
+    """
+    Raised for PNG files that can't be read row by row (interlaced, not 8 bits per sample, etc.).
+    """
+
+
+def read_chunks(file) -> (bytes, bytes):
+    """
+    This function yields the (type, data) of each chunk of the PNG file, until the IDAT chunks.
+    The data of the IDAT chunks isn't read here, it is streamed by read_idat_data.
+    """
+    if file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+        raise UnsupportedPngError("Not a PNG file.")
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            raise UnsupportedPngError("The PNG file ended before its image data.")
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'IDAT':
+            yield chunk_type, length
+            return
+        data = file.read(length)
+        file.read(4)  # CRC
+        yield chunk_type, data
+
+
+def read_idat_data(file, first_idat_length: int) -> bytes:
+    """
+    This function yields the compressed image data of all the (consecutive) IDAT chunks,
+    in pieces of at most READ_CHUNK_SIZE bytes.
+    """
+    length = first_idat_length
+    while True:
+        while length:
+            piece = file.read(min(length, READ_CHUNK_SIZE))
+            if not piece:
+                return
+            length -= len(piece)
+            yield piece
+        file.read(4)  # CRC
+        header = file.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type != b'IDAT':
+            return
+
+
+def unfilter_rows(filter_types: np.ndarray, filtered_rows: np.ndarray, previous_row: np.ndarray,
+                  bytes_per_pixel: int) -> np.ndarray:
+    """
+    This function reverses the PNG filters of a strip of rows.
+    :param filter_types: The filter type of each row.
+    :param filtered_rows: The filtered bytes of each row (rows x row bytes).
+    :param previous_row: The (already unfiltered) row before the strip, zeros for the first strip.
+    :param bytes_per_pixel: Number of bytes of each pixel.
+    :return: The unfiltered rows.
+    """
+    num_of_rows, row_size = filtered_rows.shape
+    if np.all(filter_types <= FILTER_UP):
+        # None, Sub and Up are solved for a whole row at once
+        rows = np.empty_like(filtered_rows)
+        for row_num in range(num_of_rows):
+            filtered_row = filtered_rows[row_num]
+            if filter_types[row_num] == FILTER_SUB:
+                rows[row_num] = np.cumsum(filtered_row.reshape(-1, bytes_per_pixel), axis=0,
+                                          dtype=np.uint8).reshape(-1)
+            elif filter_types[row_num] == FILTER_UP:
+                rows[row_num] = filtered_row + previous_row
+            else:
+                rows[row_num] = filtered_row
+            previous_row = rows[row_num]
+        return rows
+
+    # Average and Paeth depend on the (unfiltered) pixel to the left of each pixel, so they can't be solved for
+    # a whole row at once, and are solved by the PNG decoder of Pillow instead: the previous row (unfiltered,
+    # with the filter None) and the strip are stored (not compressed again) in a zlib stream, and decoded
+    mode = RAW_MODES[bytes_per_pixel]
+    data = np.empty((num_of_rows + 1, row_size + 1), dtype=np.uint8)
+    data[0, 0] = FILTER_NONE
+    data[0, 1:] = previous_row
+    data[1:, 0] = filter_types
+    data[1:, 1:] = filtered_rows
+    image = Image.frombytes(mode, (row_size // bytes_per_pixel, num_of_rows + 1), zlib.compress(data, level=0),
+                            'zip', mode)
+    return np.array(image).reshape(num_of_rows + 1, row_size)[1:]
+
+
+def rows_to_rgb(rows: np.ndarray, color_type: int, palette: np.ndarray) -> np.ndarray:
+    """
+    This function converts unfiltered rows of any supported color type to RGB values,
+    the same way Image.convert(mode='RGB') does.
+    """
+    num_of_rows = rows.shape[0]
+    pixels = rows.reshape(num_of_rows, -1, BYTES_PER_PIXEL[color_type])
+    if color_type == TRUECOLOR:
+        return pixels
+    if color_type == TRUECOLOR_ALPHA:
+        return np.ascontiguousarray(pixels[:, :, :3])
+    if color_type == INDEXED:
+        return palette[pixels[:, :, 0]]
+    # Grayscale (with or without alpha)
+    return np.repeat(pixels[:, :, :1], 3, axis=2)
+
+
+def rows_to_rgba(rows: np.ndarray, color_type: int, palette: np.ndarray) -> np.ndarray:
+    """
+    This function converts unfiltered rows of any supported color type to RGBA values.
+    Only the alpha channel of the color types with one is kept, the transparency of a tRNS chunk is not.
+    """
+    num_of_rows = rows.shape[0]
+    pixels = rows.reshape(num_of_rows, -1, BYTES_PER_PIXEL[color_type])
+    if color_type == TRUECOLOR_ALPHA:
+        return pixels
+    rgba = np.empty(pixels.shape[:2] + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = rows_to_rgb(rows, color_type, palette)
+    rgba[:, :, 3] = pixels[:, :, 1] if color_type == GRAYSCALE_ALPHA else 255
+    return rgba
+
+
+def iter_png_row_strips(png_file_path: str, rows_per_strip: int, mode: str = 'RGB') -> np.ndarray:
+    """
+    This function yields the image saved in the given PNG file as np arrays of RGB (or RGBA) values,
+    rows_per_strip rows at a time, while reading and decompressing only what each strip needs.
+    So the memory used doesn't depend on the size of the image, only on the size of a strip.
+
+    PNG files that can't be read row by row (interlaced, 16 bits, etc.) are loaded
+    with Pillow as a whole, and then yielded strip by strip.
+    :param mode: 'RGB' or 'RGBA'.
+    """
+    try:
+        yield from _iter_png_row_strips(png_file_path, rows_per_strip, mode)
+    except UnsupportedPngError:
+        with Image.open(png_file_path) as image:
+            np_array = np.array(image.convert(mode=mode))
+        for first_row in range(0, np_array.shape[0], rows_per_strip):
+            yield np_array[first_row:first_row + rows_per_strip]
+
+
+def _iter_png_row_strips(png_file_path: str, rows_per_strip: int, mode: str) -> np.ndarray:
+    with open(png_file_path, 'rb') as file:
+        header = None
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        for chunk_type, data in read_chunks(file):
+            if chunk_type == b'IHDR':
+                header = struct.unpack('>IIBBBBB', data)
+            elif chunk_type == b'PLTE':
+                entries = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+                palette[:len(entries)] = entries
+            elif chunk_type == b'IDAT':
+                first_idat_length = data
+        if header is None:
+            raise UnsupportedPngError("The PNG file has no header.")
+        width, height, bit_depth, color_type, _, _, interlace = header
+        if bit_depth != 8 or interlace or color_type not in BYTES_PER_PIXEL:
+            raise UnsupportedPngError("Only non-interlaced PNG files with 8 bits samples are read by rows.")
+
+        bytes_per_pixel = BYTES_PER_PIXEL[color_type]
+        row_size = width * bytes_per_pixel
+        strip_size = rows_per_strip * (row_size + 1)
+        previous_row = np.zeros(row_size, dtype=np.uint8)
+        decompressor = zlib.decompressobj()
+        pending = bytearray()
+        rows_left = height
+
+        def strip_from_pending(num_of_rows: int) -> np.ndarray:
+            nonlocal previous_row
+            filtered = np.frombuffer(pending, dtype=np.uint8, count=num_of_rows * (row_size + 1))
+            filtered = filtered.reshape(num_of_rows, row_size + 1)
+            rows = unfilter_rows(filtered[:, 0], filtered[:, 1:], previous_row, bytes_per_pixel)
+            del filtered
+            del pending[:num_of_rows * (row_size + 1)]
+            previous_row = rows[-1].copy()
+            return rows_to_rgba(rows, color_type, palette) if mode == 'RGBA' else rows_to_rgb(rows, color_type, palette)
+
+        for piece in read_idat_data(file, first_idat_length):
+            while piece and rows_left:
+                # Bound the decompressed size, a small piece of a flat image may decompress to a huge one
+                pending += decompressor.decompress(piece, strip_size)
+                piece = decompressor.unconsumed_tail
+                while rows_left and len(pending) >= min(rows_per_strip, rows_left) * (row_size + 1):
+                    num_of_rows = min(rows_per_strip, rows_left)
+                    rows_left -= num_of_rows
+                    yield strip_from_pending(num_of_rows)
+        if rows_left:
+            pending += decompressor.flush()
+            if len(pending) < rows_left * (row_size + 1):
+                raise ValueError("The PNG file is truncated.")
+            while rows_left:
+                num_of_rows = min(rows_per_strip, rows_left)
+                rows_left -= num_of_rows
+                yield strip_from_pending(num_of_rows)
+
+
+def write_chunk(file, chunk_type: bytes, data: bytes) -> None:
+    file.write(struct.pack('>I4s', len(data), chunk_type))
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+class PngWriter(object):
+
+    def __init__(self, png_file_path: str, width: int, height: int, mode: str = 'RGB') -> None:
+        """
+        This class writes an RGB (or RGBA) image to a PNG file strip by strip of rows (see write_rows),
+        compressing each strip as it arrives, so the whole image is never in memory.
+        Every row is saved with the Up filter, which is reversed for a whole row at once when it is read.
+        """
+        self.file = open(png_file_path, 'wb')
+        color_type = TRUECOLOR_ALPHA if mode == 'RGBA' else TRUECOLOR
+        self.row_size = width * BYTES_PER_PIXEL[color_type]
+        self.rows_left = height
+        self.previous_row = np.zeros(self.row_size, dtype=np.uint8)
+        self.compressor = zlib.compressobj()
+        self.pending = bytearray()
+        self.file.write(PNG_SIGNATURE)
+        write_chunk(self.file, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+
+    def write_rows(self, rows: np.ndarray) -> None:
+        """
+        Writes the next rows of the image (rows x width x 3 RGB, or 4 RGBA, values).
+        """
+        rows = rows.reshape(-1, self.row_size)
+        if rows.shape[0] > self.rows_left:
+            raise ValueError("More rows were written than the height of the image.")
+        self.rows_left -= rows.shape[0]
+        filtered = np.empty((rows.shape[0], self.row_size + 1), dtype=np.uint8)
+        filtered[:, 0] = FILTER_UP
+        # The difference (modulo 256) of each row from the row above it
+        np.subtract(rows[:1], self.previous_row, out=filtered[:1, 1:])
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+        self.previous_row = rows[-1].copy()
+        self.write_data(self.compressor.compress(filtered))
+
+    def write_data(self, data: bytes) -> None:
+        self.pending += data
+        while len(self.pending) >= WRITE_CHUNK_SIZE:
+            write_chunk(self.file, b'IDAT', bytes(self.pending[:WRITE_CHUNK_SIZE]))
+            del self.pending[:WRITE_CHUNK_SIZE]
+
+    def close(self) -> None:
+        """
+        Writes the end of the image, and closes the file.
+        """
+        try:
+            if self.rows_left:
+                raise ValueError(f"The image is missing its last {self.rows_left} rows.")
+            self.write_data(self.compressor.flush())
+            write_chunk(self.file, b'IDAT', bytes(self.pending))
+            write_chunk(self.file, b'IEND', b'')
+        finally:
+            self.file.close()
+
+    def __enter__(self) -> 'PngWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+
+def png_image_size(png_file_path: str) -> (int, int):
+    """
+    This function returns the (width, height) of the image saved in the given PNG file,
+    without decoding it.
+    """
+    with Image.open(png_file_path) as image:
+        return image.size
@@ -0,0 +1,93 @@
+import time
+
+
+class DecodeProfile(object):
+
+    def __init__(self, hooks: list = None) -> None:
+        """
+        This class records where the time of decoding an image goes: the wall time, the number of calls,
+        and the number of items handled (symbols, tokens, words, etc.) of each stage of the decoding,
+        for each offset and each channel.
+
+        The decoding functions get a profile and record every stage they run in it (see record).
+        :param hooks: Functions to call after each stage is recorded,
+        with (stage, seconds, offset, channel, counts) - offset and channel are None for stages of all of them.
+        """
+        self.hooks = hooks or []
+        # (stage, offset, channel) -> {'seconds': ..., 'calls': ..., and the counts of the stage}
+        self.records = {}
+        self.start_time = time.perf_counter()
+
+    @staticmethod
+    def clock() -> float:
+        return time.perf_counter()
+
+    def record(self, stage: str, start_time: float, offset: int = None, channel: int = None, **counts: int) -> None:
+        """
+        Records a single run of a stage, that started at start_time (see clock).
+        :param counts: Number of items of each kind that the stage handled, e.g. symbols=1000, tokens=50.
+        """
+        seconds = time.perf_counter() - start_time
+        self.add_record((stage, offset, channel), dict(counts, seconds=seconds, calls=1))
+        for hook in self.hooks:
+            hook(stage, seconds, offset, channel, counts)
+
+    def add_record(self, key: (str, int, int), values: dict) -> None:
+        record = self.records.setdefault(key, {'seconds': 0.0, 'calls': 0})
+        for name, value in values.items():
+            record[name] = record.get(name, 0) + (value if name == 'seconds' else int(value))
+
+    def add_records(self, records: dict) -> None:
+        """
+        Adds the records of another profile (e.g. of decoding in a worker process) to this one.
+        The hooks are not called for them.
+        """
+        for key, values in records.items():
+            self.add_record(key, values)
+
+    def stage_totals(self, by_offset: bool = False, by_channel: bool = False) -> dict:
+        """
+        Sums the records of each stage (over all the offsets and channels, unless grouped by them).
+        """
+        totals = {}
+        for (stage, offset, channel), record in self.records.items():
+            if by_offset and offset is None or by_channel and channel is None:
+                continue
+            group = totals
+            if by_offset:
+                group = group.setdefault(str(offset), {})
+            if by_channel:
+                group = group.setdefault(str(channel), {})
+            total = group.setdefault(stage, {})
+            for name, value in record.items():
+                total[name] = total.get(name, 0) + value
+        return totals
+
+    def to_dict(self) -> dict:
+        """
+        Returns the profile as a JSON-serializable dict: the totals of each stage,
+        and the totals of each stage for each offset and for each channel.
+        """
+        return {'seconds': round(time.perf_counter() - self.start_time, 6),
+                'stages': self.stage_totals(),
+                'offsets': self.stage_totals(by_offset=True),
+                'channels': self.stage_totals(by_channel=True)}
+
+
+class NoProfile(DecodeProfile):
+    """
+    The profile used when decoding isn't profiled, it records nothing.
+    """
+
+    @staticmethod
+    def clock() -> float:
+        return 0.0
+
+    def record(self, stage: str, start_time: float, offset: int = None, channel: int = None, **counts: int) -> None:
+        pass
+
+    def add_records(self, records: dict) -> None:
+        pass
+
+
+NO_PROFILE = NoProfile()
@@ -0,0 +1,332 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+import decode_cache
+import dictionary
+import steg_decode
+import steg_detect
+import steg_hide
+import utils
+
+# The cache of the decoding results of a worker process of a scan (see init_scan_worker)
+worker_cache = None
+# A worker of a scan decodes only the images that are at least this likely to carry a payload (all of them if None)
+worker_detect_threshold = None
+
+
+class HideJob(object):
+
+    def __init__(self, image_path: str, text_path: str, output_path: str = None) -> None:
+        """
+        This class represents a single hiding job of a batch: hiding one text file in one image.
+        :param image_path: Path of the PNG image to hide the text in.
+        :param text_path: Path of a TXT file that contains the text to hide.
+        :param output_path: Path for saving the image with the hidden text (next to the image if not given).
+        """
+        self.image_path = image_path
+        self.text_path = text_path
+        self.output_path = output_path or utils.get_output_path(image_path, utils.Stage.HIDE)
+
+
+def read_manifest(manifest_path: str) -> [HideJob]:
+    """
+    This function reads the hiding jobs from a manifest file.
+    The manifest is either a CSV file with the header "image,text,output", or a JSONL file
+    with an {"image": ..., "text": ..., "output": ...} object in each line ("output" is optional).
+    Relative paths are relative to the manifest's directory.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path: str) -> str or None:
+        return os.path.join(manifest_dir, path) if path else None
+
+    with open(manifest_path, 'r', newline='') as file:
+        if manifest_path.lower().endswith('.jsonl'):
+            rows = [json.loads(line) for line in file if line.strip()]
+        else:
+            rows = list(csv.DictReader(file))
+
+    jobs = []
+    for line_num, row in enumerate(rows, start=1):
+        if not row.get('image') or not row.get('text'):
+            raise ValueError(f"Line {line_num} of the manifest must have both 'image' and 'text'.")
+        jobs.append(HideJob(resolve(row['image']), resolve(row['text']), resolve(row.get('output'))))
+    return jobs
+
+
+def jobs_of_directory(images_dir: str, text_path: str = None) -> [HideJob]:
+    """
+    This function creates a hiding job for every PNG image in the given directory.
+    Each image gets the text of the given TXT file, or if it isn't given,
+    the text of the TXT file with the same name as the image (image.png -> image.txt).
+    Images that are already an output of the hiding stage are ignored.
+    """
+    hidden_suffix = utils.get_output_path('', utils.Stage.HIDE)
+    jobs = []
+    for file_name in sorted(os.listdir(images_dir)):
+        if not file_name.lower().endswith('.png') or file_name.endswith(hidden_suffix):
+            continue
+        image_path = os.path.join(images_dir, file_name)
+        jobs.append(HideJob(image_path, text_path or f"{image_path[:-4]}.txt"))
+    return jobs
+
+
+def run_hide_job(job: HideJob) -> dict:
+    """
+    This function runs a single hiding job, in a worker process of the pool.
+    It never raises, so a failure of one job doesn't abort the whole batch -
+    the failure is reported in the returned result instead.
+    """
+    result = {'image': job.image_path, 'text': job.text_path, 'output': job.output_path}
+    try:
+        steg_hide.hide(job.image_path, steg_hide.read_text_file(job.text_path), job.output_path)
+        result['success'] = True
+    except Exception as e:
+        result['success'] = False
+        result['error'] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def hide_batch(jobs: [HideJob], workers: int = None) -> [dict]:
+    """
+    This function runs all the given hiding jobs over a pool of worker processes,
+    so each worker pays the Python, NumPy and Pillow startup only once for many images.
+    Results are yielded (in the order of the jobs) as soon as they are ready.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Sending the jobs in chunks saves most of the inter-process communication of small images
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(run_hide_job, jobs, chunksize=chunksize)
+
+
+def images_of_directory_tree(images_dir: str) -> [str]:
+    """
+    This function yields the paths of all the PNG images in the given directory and its subdirectories.
+    """
+    for dir_path, dir_names, file_names in os.walk(images_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.lower().endswith('.png'):
+                yield os.path.join(dir_path, file_name)
+
+
+def images_of_file_list(list_path: str) -> [str]:
+    """
+    This function yields the image paths written in the given file (one path in each line),
+    or in the standard input if the given path is '-'.
+    """
+    file = sys.stdin if list_path == '-' else open(list_path, 'r')
+    try:
+        for line in file:
+            if line.strip():
+                yield line.strip()
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+def init_scan_worker(wordlist_path: str = None, cache_path: str = None,
+                     max_cache_size: int = decode_cache.DEFAULT_MAX_CACHE_SIZE,
+                     detect_threshold: float = None) -> None:
+    """
+    This function runs once in each worker process of a scan when it starts:
+    it loads the wordlist, and opens the cache of the decoding results, if they are given.
+    """
+    global worker_cache, worker_detect_threshold
+    worker_detect_threshold = detect_threshold
+    if wordlist_path:
+        dictionary.use_wordlist(wordlist_path)
+    if cache_path:
+        worker_cache = decode_cache.DecodeCache(cache_path, max_cache_size)
+
+
+def run_decode_job(image_path: str) -> dict:
+    """
+    This function decodes a single image, in a worker process of the pool.
+    If the worker has a detection threshold, the image is first checked for a payload (see steg_detect.py),
+    and decoded only if it is flagged.
+    If the worker has a cache (see init_scan_worker), an image that was scanned before isn't checked or decoded
+    again, and an unchanged file isn't even read (see decode_cache.cached_scan_png_file).
+    Like run_hide_job, it never raises, and reports a failure in the returned result instead.
+    """
+    result = {'path': image_path}
+    start_time = time.perf_counter()
+    try:
+        if worker_cache is not None:
+            result.update(decode_cache.cached_scan_png_file(image_path, worker_cache, worker_detect_threshold))
+        elif worker_detect_threshold is not None:
+            image_as_np_array = utils.png_file_to_np_array(image_path)
+            detection = steg_detect.detect(image_as_np_array)
+            result['probability'] = detection['probability']
+            result['payload_bytes'] = detection['payload_bytes']
+            result['flagged'] = detection['probability'] >= worker_detect_threshold
+            if result['flagged']:
+                result['guess'] = steg_decode.decode_png_image(image_as_np_array)
+        else:
+            result['guess'] = steg_decode.decode_png_file(image_path)
+        if 'guess' in result:
+            result['word_count'] = len(result['guess'].split())
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['elapsed'] = round(time.perf_counter() - start_time, 6)
+    return result
+
+
+def scan(image_paths: [str], workers: int = None, max_in_flight: int = None, wordlist_path: str = None,
+         cache_path: str = None, max_cache_size: int = decode_cache.DEFAULT_MAX_CACHE_SIZE,
+         detect_threshold: float = None) -> [dict]:
+    """
+    This function decodes all the given images over a pool of worker processes,
+    and yields the result of each image as soon as it finishes (not in the order of the images).
+
+    At most max_in_flight images are submitted to the pool at any moment, so scanning a huge
+    directory doesn't queue all of its paths (and results) in memory at once.
+    If wordlist_path is given, each worker loads it once, and uses it instead of the most common English words.
+    If cache_path is given, the results are cached in it (see decode_cache.py), so the images that were
+    scanned before are skipped, and only new and changed images are decoded.
+    If detect_threshold is given, each image is checked for a payload first (see steg_detect.py), which is a few
+    times faster than decoding it, and only the images that are at least this likely to carry one are decoded.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_scan_worker,
+                             initargs=(wordlist_path, cache_path, max_cache_size, detect_threshold)) as executor:
+        in_flight = set()
+        for image_path in image_paths:
+            in_flight.add(executor.submit(run_decode_job, image_path))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def scan_main(args: argparse.Namespace) -> int:
+    if args.dir:
+        image_paths = images_of_directory_tree(args.dir)
+    else:
+        image_paths = images_of_file_list(args.files)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    failed = 0
+    try:
+        for result in scan(image_paths, args.workers, args.max_in_flight, args.wordlist, args.cache,
+                           args.cache_max_size, args.detect_threshold):
+            failed += 'error' in result
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+def hide_main(args: argparse.Namespace) -> int:
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        jobs = jobs_of_directory(args.dir, args.text)
+
+    print(f"\nThe batch hiding process of {len(jobs)} images started. The time is: {datetime.now()}\n")
+    failed = 0
+    report = open(args.report, 'w') if args.report else None
+    try:
+        for result in hide_batch(jobs, args.workers):
+            if result['success']:
+                print(f"OK     {result['image']} -> {result['output']}")
+            else:
+                failed += 1
+                print(f"FAILED {result['image']}: {result['error']}")
+            if report:
+                report.write(json.dumps(result) + '\n')
+    finally:
+        if report:
+            report.close()
+
+    print(f"\nThe batch hiding process finished. The time is: {datetime.now()}\n"
+          f"{len(jobs) - failed} images succeeded, {failed} images failed.")
+    return 1 if failed else 0
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program and call the main logic.
+    """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    hide_parser = subparsers.add_parser('hide', help='Hide texts in many PNG images.')
+    source = hide_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest',
+                        type=str,
+                        help='Path of a CSV (image,text,output) or JSONL manifest of the images to hide texts in.')
+    source.add_argument('--dir',
+                        type=str,
+                        help='Path of a directory with PNG images to hide texts in.')
+    hide_parser.add_argument('--text',
+                             type=str,
+                             help='Path of a TXT file to hide in all the images of --dir '
+                                  '(default: the TXT file with the same name as each image).')
+    hide_parser.add_argument('--workers',
+                             type=int,
+                             help='Number of worker processes (default: number of CPUs).')
+    hide_parser.add_argument('--report',
+                             type=str,
+                             help='Path of a JSONL file to write the result of each image to.')
+
+    scan_parser = subparsers.add_parser('scan', help='Find hidden texts in many PNG images.')
+    source = scan_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dir',
+                        type=str,
+                        help='Path of a directory tree with PNG images to scan.')
+    source.add_argument('--files',
+                        type=str,
+                        help="Path of a file with the path of an image to scan in each line ('-' for stdin).")
+    scan_parser.add_argument('--workers',
+                             type=int,
+                             help='Number of worker processes (default: number of CPUs).')
+    scan_parser.add_argument('--max-in-flight',
+                             type=int,
+                             help='Maximal number of images being decoded or waiting in the pool '
+                                  '(default: twice the number of workers).')
+    scan_parser.add_argument('--wordlist',
+                             type=str,
+                             help='Path of a wordlist (TXT or compact dictionary file) to use instead of the '
+                                  'most common English words.')
+    scan_parser.add_argument('--cache',
+                             type=str,
+                             help='Path of a cache file of the results (created if missing), '
+                                  'so images that were scanned before are not decoded again.')
+    scan_parser.add_argument('--cache-max-size',
+                             type=utils.parse_memory_size,
+                             default=decode_cache.DEFAULT_MAX_CACHE_SIZE,
+                             help='Evict the least recently used results when the cache is bigger than this size '
+                                  '(default: 1G).')
+    scan_parser.add_argument('--detect-threshold',
+                             type=float,
+                             help='Check each image for a payload first (see steg_detect.py), and decode only the '
+                                  'images that are at least this likely to carry one (e.g. 0.5).')
+    scan_parser.add_argument('--output',
+                             type=str,
+                             help='Path of a JSONL file to write the results to (default: stdout).')
+
+    args = parser.parse_args()
+    if args.mode == 'hide':
+        sys.exit(hide_main(args))
+    if args.mode == 'scan':
+        sys.exit(scan_main(args))
+
+
+if __name__ == '__main__':
+    main()
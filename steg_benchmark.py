@@ -0,0 +1,340 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import config
+import framing
+import steg_decode
+import steg_hide
+from config import SPACE
+from profiling import DecodeProfile
+
+RESULTS_VERSION = 1
+DEFAULT_MEGAPIXELS = [0.5, 2, 10, 50]
+DEFAULT_MODES = ['RGB', 'RGBA']
+DEFAULT_KINDS = ['noisy', 'flat']
+DEFAULT_PAYLOAD_SIZES = [100, 10_000, 1_000_000]
+QUICK_MEGAPIXELS = [0.5]
+QUICK_PAYLOAD_SIZES = [100, 10_000]
+# 'raw' hides the text as is (decoded by guessing), the others hide it framed and compressed
+RAW_PAYLOAD = 'raw'
+DEFAULT_COMPRESSIONS = [RAW_PAYLOAD]
+DEFAULT_THRESHOLD = 0.2
+# Differences of less than this number of seconds are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.05
+FLAT_COLOR = 128
+# The memory of hiding the payload of each case strip by strip too (see steg_hide.hide_text_file_streaming)
+STREAM_HIDE_MEMORY = 64 << 20
+
+
+class BenchmarkCase(object):
+
+    def __init__(self, megapixels: float, mode: str, kind: str, payload_size: int, seed: int = 0,
+                 compression: str = RAW_PAYLOAD) -> None:
+        """
+        This class represents a single benchmark case: hiding a payload in a synthetic image, and decoding it.
+        :param megapixels: Size of the image, in millions of pixels.
+        :param mode: 'RGB' or 'RGBA'.
+        :param kind: 'noisy' (random colors) or 'flat' (a single color).
+        :param payload_size: Size of the hidden text, in bytes.
+        :param seed: Seed of the random image and text, so every run benchmarks the same files.
+        :param compression: 'raw', or the compression of the text (see framing.COMPRESSION_FLAGS).
+        """
+        self.megapixels = megapixels
+        self.mode = mode
+        self.kind = kind
+        self.payload_size = payload_size
+        self.seed = seed
+        self.compression = compression
+
+    @property
+    def image_name(self) -> str:
+        return f"{self.megapixels}mp_{self.mode.lower()}_{self.kind}_{self.seed}"
+
+    @property
+    def name(self) -> str:
+        # Raw cases keep their names, so they are compared to the results of runs from before compression
+        name = f"{self.image_name}_{self.payload_size}b"
+        return name if self.compression == RAW_PAYLOAD else f"{name}_{self.compression}"
+
+    @property
+    def compression_flags(self) -> int:
+        return 0 if self.compression == RAW_PAYLOAD else framing.compression_flags(self.compression)
+
+    @property
+    def image_size(self) -> (int, int):
+        num_of_pixels = int(self.megapixels * 1_000_000)
+        width = int(num_of_pixels ** 0.5)
+        return width, max(num_of_pixels // width, 1)
+
+    def fits(self) -> bool:
+        """
+        Whether the payload can be hidden in the image, counted as steg_hide counts it: the colors from the start
+        of the image to the end of the payload (and its header, if it is framed), of all the channels of the image.
+        RGBA images are hidden in as RGBA, so their alpha colors are counted too, though the payload skips them.
+        """
+        width, height = self.image_size
+        bytes_to_hide = b''.join(framing.compress_payload_chunks(
+            (steg_hide.text_to_bytes(generate_payload(self.payload_size, self.seed)),), self.compression_flags))
+        header = framing.payload_header(bytes_to_hide, self.compression_flags) if self.compression_flags else None
+        num_of_colors = steg_hide.num_of_needed_colors(len(bytes_to_hide), header, len(self.mode))
+        return num_of_colors <= width * height * len(self.mode)
+
+
+def generate_image(case: BenchmarkCase, image_path: str) -> None:
+    """
+    This function creates the synthetic image of the given case and saves it as a PNG file.
+    """
+    width, height = case.image_size
+    rng = np.random.default_rng(case.seed)
+    num_of_channels = len(case.mode)
+    if case.kind == 'noisy':
+        np_array = rng.integers(0, 256, size=(height, width, num_of_channels), dtype=np.uint8)
+    else:
+        np_array = np.full((height, width, num_of_channels), FLAT_COLOR, dtype=np.uint8)
+    if case.mode == 'RGBA':
+        np_array[:, :, 3] = 255
+    Image.fromarray(np_array, mode=case.mode).save(image_path)
+
+
+def generate_payload(size: int, seed: int = 0) -> str:
+    """
+    This function creates a sentence of (at most) the given size, made of the most common English words,
+    so the decoder can find all of it.
+    """
+    rng = np.random.default_rng(seed)
+    words = [word for word in config.MOST_COMMON_ENGLISH_WORDS_LOWERCASE if word.isalpha()]
+    # Each word takes at least 2 bytes (with its space), so this is always enough words
+    chosen_words = [words[i] for i in rng.integers(0, len(words), size=size // 2 + 1)]
+    text = SPACE.join(chosen_words)
+    # Without the last word, that was cut in the middle
+    text = text[:text.rfind(SPACE, 0, size)]
+    return f"{text.capitalize()}."
+
+
+def peak_rss() -> int:
+    """
+    This function returns the peak resident memory of the current process, in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_hide_phase(image_path: str, text_path: str, output_path: str, compression: str = RAW_PAYLOAD) -> dict:
+    with open(text_path, 'r') as file:
+        text = file.read()
+    start_time = time.perf_counter()
+    steg_hide.hide(image_path, text, output_path, compression=None if compression == RAW_PAYLOAD else compression)
+    return {'stages': {'hide': time.perf_counter() - start_time}, 'peak_rss': peak_rss()}
+
+
+def run_stream_hide_phase(image_path: str, text_path: str, output_path: str,
+                          compression: str = RAW_PAYLOAD) -> dict:
+    """
+    Hides the text file in the image strip by strip, and decodes the new image back, to check the round trip.
+    """
+    start_time = time.perf_counter()
+    steg_hide.hide_text_file_streaming(image_path, text_path, STREAM_HIDE_MEMORY, output_path,
+                                       compression=None if compression == RAW_PAYLOAD else compression)
+    stages = {'stream_hide': time.perf_counter() - start_time}
+    start_time = time.perf_counter()
+    guess = steg_decode.decode_png_file(output_path)
+    stages['stream_decode'] = time.perf_counter() - start_time
+    return {'stages': stages, 'peak_rss': peak_rss(), 'guess': guess}
+
+
+def run_decode_phase(image_path: str) -> dict:
+    """
+    Decodes the image, and times each of the stages of the decoding (see DecodeProfile) too.
+    """
+    profile = DecodeProfile()
+    start_time = time.perf_counter()
+    guess = steg_decode.decode_png_file(image_path, profile=profile)
+    stages = {'decode': time.perf_counter() - start_time}
+    for stage, totals in profile.stage_totals().items():
+        stages[stage] = totals['seconds']
+    return {'stages': stages, 'peak_rss': peak_rss(), 'guess': guess}
+
+
+def run_in_new_process(function, *args) -> dict:
+    """
+    Runs the function in a new process, so its peak memory is measured alone.
+    """
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(function, *args).result()
+
+
+def run_case(case: BenchmarkCase, work_dir: str, repeat: int = 1) -> dict:
+    """
+    This function benchmarks a single case: every phase runs (repeat times) in a new process,
+    the best time of each stage and the highest peak memory of each phase are kept.
+    """
+    result = {'name': case.name, 'megapixels': case.megapixels, 'mode': case.mode, 'kind': case.kind,
+              'payload_size': case.payload_size, 'compression': case.compression}
+    if not case.fits():
+        result['skipped'] = 'The payload is too big for the image.'
+        return result
+
+    image_path = os.path.join(work_dir, f"{case.image_name}.png")
+    if not os.path.exists(image_path):
+        generate_image(case, image_path)
+    text_path = os.path.join(work_dir, f"payload_{case.payload_size}_{case.seed}.txt")
+    text = generate_payload(case.payload_size, case.seed)
+    with open(text_path, 'w') as file:
+        file.write(text)
+    hidden_image_path = os.path.join(work_dir, f"{case.name}_hidden.png")
+    stream_hidden_image_path = os.path.join(work_dir, f"{case.name}_stream_hidden.png")
+    # The number of bytes that are actually hidden (the colors changed and read are 8 times as many)
+    result['hidden_bytes'] = sum(map(len, framing.compress_payload_chunks((steg_hide.text_to_bytes(text),),
+                                                                          case.compression_flags)))
+
+    stages = {}
+    peaks = {}
+    for _ in range(repeat):
+        phases = {'hide': run_in_new_process(run_hide_phase, image_path, text_path, hidden_image_path,
+                                             case.compression),
+                  'decode': run_in_new_process(run_decode_phase, hidden_image_path),
+                  'stream_hide': run_in_new_process(run_stream_hide_phase, image_path, text_path,
+                                                    stream_hidden_image_path, case.compression)}
+        for phase, phase_result in phases.items():
+            for stage, seconds in phase_result['stages'].items():
+                stages[stage] = round(min(seconds, stages.get(stage, seconds)), 6)
+            peaks[phase] = max(phase_result['peak_rss'], peaks.get(phase, 0))
+        result['decoded_correctly'] = phases['decode']['guess'] == text
+        result['stream_decoded_correctly'] = phases['stream_hide']['guess'] == text
+
+    os.remove(hidden_image_path)
+    os.remove(stream_hidden_image_path)
+    result['stages'] = stages
+    result['peak_rss'] = peaks
+    return result
+
+
+def compare_to_baseline(results: dict, baseline: dict, threshold: float) -> [str]:
+    """
+    This function compares the stage times of each case to the same case in the baseline results.
+    :return: A description of every stage that is slower than in the baseline by more than threshold
+    (a fraction, 0.2 is 20%).
+    """
+    baseline_cases = {case['name']: case for case in baseline['cases'] if 'stages' in case}
+    regressions = []
+    for case in results['cases']:
+        if 'stages' not in case or case['name'] not in baseline_cases:
+            continue
+        baseline_stages = baseline_cases[case['name']]['stages']
+        for stage, seconds in case['stages'].items():
+            baseline_seconds = baseline_stages.get(stage)
+            if baseline_seconds is None:
+                continue
+            if seconds > baseline_seconds * (1 + threshold) and seconds - baseline_seconds > MIN_REGRESSION_SECONDS:
+                regressions.append(f"{case['name']} {stage}: {baseline_seconds:.3f}s -> {seconds:.3f}s "
+                                   f"(+{(seconds / baseline_seconds - 1) * 100:.0f}%)")
+    return regressions
+
+
+def parse_list(values: str, value_type: type) -> list:
+    return [value_type(value) for value in values.split(',') if value.strip()]
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--megapixels',
+                        type=lambda values: parse_list(values, float),
+                        help=f'Comma separated image sizes, in millions of pixels (default: {DEFAULT_MEGAPIXELS}).')
+    parser.add_argument('--modes',
+                        type=lambda values: parse_list(values, str),
+                        default=DEFAULT_MODES,
+                        help=f'Comma separated image modes (default: {DEFAULT_MODES}).')
+    parser.add_argument('--kinds',
+                        type=lambda values: parse_list(values, str),
+                        default=DEFAULT_KINDS,
+                        help=f'Comma separated image kinds, noisy and/or flat (default: {DEFAULT_KINDS}).')
+    parser.add_argument('--payloads',
+                        type=lambda values: parse_list(values, int),
+                        help=f'Comma separated payload sizes, in bytes (default: {DEFAULT_PAYLOAD_SIZES}).')
+    parser.add_argument('--compressions',
+                        type=lambda values: parse_list(values, str),
+                        default=DEFAULT_COMPRESSIONS,
+                        help=f'Comma separated ways to hide each payload, {RAW_PAYLOAD} and/or '
+                             f'{", ".join(framing.COMPRESSION_FLAGS)} (default: {DEFAULT_COMPRESSIONS}).')
+    parser.add_argument('--quick',
+                        action='store_true',
+                        help=f'Only small images and payloads ({QUICK_MEGAPIXELS} MP, {QUICK_PAYLOAD_SIZES} B).')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=1,
+                        help='Number of times to run each case, the best time is kept (default: 1).')
+    parser.add_argument('--work-dir',
+                        type=str,
+                        default='benchmark_files',
+                        help='Directory for the generated images, which are reused by the next runs.')
+    parser.add_argument('--output',
+                        type=str,
+                        help='Path of a JSON file to write the results to.')
+    parser.add_argument('--baseline',
+                        type=str,
+                        help='Path of the JSON results of a previous run on the same machine to compare to '
+                             '(e.g. of the code before a change), fail if a stage regressed.')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help=f'Fail if a stage is slower than in the baseline by more than this fraction '
+                             f'(default: {DEFAULT_THRESHOLD}).')
+
+    args = parser.parse_args()
+    megapixels = args.megapixels or (QUICK_MEGAPIXELS if args.quick else DEFAULT_MEGAPIXELS)
+    payload_sizes = args.payloads or (QUICK_PAYLOAD_SIZES if args.quick else DEFAULT_PAYLOAD_SIZES)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    results = {'version': RESULTS_VERSION, 'python': platform.python_version(), 'numpy': np.__version__,
+               'platform': platform.platform(), 'cases': []}
+    for size in megapixels:
+        for mode in args.modes:
+            for kind in args.kinds:
+                for payload_size in payload_sizes:
+                    for compression in args.compressions:
+                        case = BenchmarkCase(size, mode, kind, payload_size, compression=compression)
+                        case_result = run_case(case, args.work_dir, args.repeat)
+                        results['cases'].append(case_result)
+                        if 'skipped' in case_result:
+                            print(f"{case_result['name']:<41} skipped: {case_result['skipped']}")
+                            continue
+                        stages = ' '.join(f"{stage}={seconds:.3f}s"
+                                          for stage, seconds in case_result['stages'].items())
+                        peak = max(case_result['peak_rss'].values()) / (1 << 20)
+                        print(f"{case_result['name']:<41} hidden={case_result['hidden_bytes']}B {stages} "
+                              f"peak_rss={peak:.0f}MB correct={case_result['decoded_correctly']} "
+                              f"stream_correct={case_result['stream_decoded_correctly']}")
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nThe results were saved in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stages regressed by more than {args.threshold * 100:.0f}%:")
+            print('\n'.join(regressions))
+            sys.exit(1)
+        print(f"\nNo stage regressed by more than {args.threshold * 100:.0f}%.")
+
+
+if __name__ == '__main__':
+    main()
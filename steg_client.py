@@ -0,0 +1,174 @@
+import argparse
+import base64
+import http.client
+import json
+import socket
+import sys
+
+# Only the standard library is imported here, so the client starts in milliseconds
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+HIDDEN_IMAGE_SUFFIX = '_hidden.png'
+
+
+class ServerError(Exception):
+    """
+    Raised when the server fails to handle a request.
+    """
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, unix_socket: str, timeout: float = None) -> None:
+        """
+        This class is an HTTP connection to a server that listens on a Unix socket.
+        """
+        super().__init__('localhost', timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+class StegClient(object):
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: str = None,
+                 timeout: float = None) -> None:
+        """
+        This class is a client of the server of steg_server.py. It keeps a single connection to the server,
+        so a request costs a round trip to it, and not a new connection.
+        :param unix_socket: Path of the Unix socket of the server, instead of its host and port.
+        """
+        if unix_socket:
+            self.connection = UnixHTTPConnection(unix_socket, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method: str, path: str, body: dict = None) -> dict:
+        """
+        Sends a request to the server, and returns its JSON response.
+        :raise ServerError: If the server failed to handle the request.
+        """
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        self.connection.request(method, path, data, headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise ServerError(result.get('error', f"The server returned {response.status}."))
+        return result
+
+    def health(self) -> dict:
+        return self.request('GET', '/health')
+
+    def decode(self, image_bytes: bytes, full_scan: bool = False, exhaustive: bool = False) -> str:
+        """
+        Returns the text that is hidden in the given PNG image (see steg_decode.decode_png_file).
+        """
+        return self.request('POST', '/decode', {'image': base64.b64encode(image_bytes).decode('ascii'),
+                                                'full_scan': full_scan, 'exhaustive': exhaustive})['text']
+
+    def hide(self, image_bytes: bytes, text: str, framed: bool = False, bits_per_channel: int = 1,
+             color_channels: str = 'RGB', compression: str = None) -> bytes:
+        """
+        Returns the given PNG image with the text hidden in it (see steg_hide.hide).
+        """
+        result = self.request('POST', '/hide', {'image': base64.b64encode(image_bytes).decode('ascii'),
+                                                'text': text, 'framed': framed, 'bits_per_channel': bits_per_channel,
+                                                'channels': color_channels, 'compression': compression})
+        return base64.b64decode(result['image'])
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program, and sends the request to the server.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host',
+                        type=str,
+                        default=DEFAULT_HOST,
+                        help=f'Host of the server (default: {DEFAULT_HOST}).')
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help=f'Port of the server (default: {DEFAULT_PORT}).')
+    parser.add_argument('--unix-socket',
+                        type=str,
+                        help='Path of the Unix socket of the server, instead of its host and port.')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    decode_parser = subparsers.add_parser('decode', help='Find the hidden text inside PNG images.')
+    decode_parser.add_argument('--image',
+                               type=str,
+                               nargs='+',
+                               help='Paths of PNG images with hidden text.',
+                               required=True)
+    decode_parser.add_argument('--full-scan',
+                               action='store_true',
+                               help='Decode all of each image completely, instead of progressively.')
+    decode_parser.add_argument('--exhaustive',
+                               action='store_true',
+                               help='Look for words in all of each image, instead of only where it looks like text.')
+
+    hide_parser = subparsers.add_parser('hide', help='Hide text inside a PNG image.')
+    hide_parser.add_argument('--image',
+                             type=str,
+                             help='Path of a PNG image.',
+                             required=True)
+    hide_parser.add_argument('--text',
+                             type=str,
+                             help='Path of a TXT file that contains the text you want to hide.',
+                             required=True)
+    hide_parser.add_argument('--output',
+                             type=str,
+                             help='Path for saving the image '
+                                  f'(default: next to the image, ending with {HIDDEN_IMAGE_SUFFIX}).')
+    hide_parser.add_argument('--framed',
+                             action='store_true',
+                             help='Hide a header with the length and the checksum of the text before it.')
+    hide_parser.add_argument('--bits-per-channel',
+                             type=int,
+                             default=1,
+                             help='Number of the lowest bits of each color to hide the text in (default: 1).')
+    hide_parser.add_argument('--channels',
+                             type=str,
+                             default='RGB',
+                             help='The colors of each pixel to hide the text in (default: RGB).')
+    hide_parser.add_argument('--compress',
+                             type=str,
+                             choices=['zlib', 'lzma'],
+                             help='Compress the text before hiding it (it is always framed then).')
+
+    args = parser.parse_args()
+    client = StegClient(args.host, args.port, args.unix_socket)
+    try:
+        if args.mode == 'decode':
+            for image_path in args.image:
+                with open(image_path, 'rb') as file:
+                    text = client.decode(file.read(), args.full_scan, args.exhaustive)
+                print(json.dumps({'path': image_path, 'text': text}))
+        else:
+            with open(args.image, 'rb') as file:
+                image_bytes = file.read()
+            with open(args.text, 'r') as file:
+                text = file.read().replace('\n', '')
+            output_path = args.output or f"{args.image[:-4] if args.image.endswith('.png') else args.image}" \
+                                         f"{HIDDEN_IMAGE_SUFFIX}"
+            with open(output_path, 'wb') as file:
+                file.write(client.hide(image_bytes, text, args.framed, args.bits_per_channel, args.channels,
+                                       args.compress))
+            print(f'The text was hidden successfully in the image!\nIt was saved in {output_path}')
+    except (ServerError, ConnectionError) as e:
+        sys.exit(f"{type(e).__name__}: {e}")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,61 @@
 import argparse
-import copy
+import cProfile
+import json
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from multiprocessing import shared_memory
 
 import numpy as np
 
 import config
+import dictionary
+import framing
+import png_stream
 import utils
-from config import SPACE, EMPTY, MAX_HIDE_CHANNELS, VALID_UPPERCASE_LETTERS, LEFT_PUNCTUATIONS, RIGHT_PUNCTUATIONS
+from profiling import DecodeProfile, NO_PROFILE
+from config import SPACE, MAX_HIDE_CHANNELS, NUM_OF_BITS_IN_ASCII_SYMBOL, VALID_UPPERCASE_LETTERS, \
+    VALID_LOWERCASE_LETTERS, VALID_TEXT_SYMBOLS_LETTERS, LEFT_PUNCTUATIONS, RIGHT_PUNCTUATIONS
+from dictionary import NOT_FOUND
+
+ELLIPSIS = '...'
+# Bump when a change of the decoding changes the texts it finds,
+# so the texts cached by the decoder before aren't reused (see decode_cache.py)
+DECODER_VERSION = 3
+
+
+def symbols_lookup_table(symbols: str) -> np.ndarray:
+    """
+    This function returns a table of 256 booleans, that tells for each uint-8 if it is the ascii value
+    of one of the given symbols. Indexing it with an array of ascii values classifies all of them at once.
+    """
+    table = np.zeros(256, dtype=bool)
+    table[list(symbols.encode('ascii'))] = True
+    return table
+
+
+IS_LETTER = symbols_lookup_table(f"{VALID_UPPERCASE_LETTERS}{VALID_LOWERCASE_LETTERS}")
+IS_UPPERCASE_LETTER = symbols_lookup_table(VALID_UPPERCASE_LETTERS)
+IS_ONE_LETTER_WORD = symbols_lookup_table('aAiI')
+IS_RIGHT_PUNCTUATION = symbols_lookup_table(RIGHT_PUNCTUATIONS)
+# Every symbol that can be a part of the text of a word (with its punctuations) or a space
+IS_TEXT_SYMBOL = symbols_lookup_table(f"{VALID_TEXT_SYMBOLS_LETTERS}{LEFT_PUNCTUATIONS}{RIGHT_PUNCTUATIONS}")
+# The symbols most of an English text is made of (see is_in_text_window)
+IS_COMMON_TEXT_SYMBOL = symbols_lookup_table(f"{VALID_LOWERCASE_LETTERS}{SPACE}"
+                                             f"{LEFT_PUNCTUATIONS}{RIGHT_PUNCTUATIONS}")
+# Bits of the classes of a symbol, that progressive decoding looks up at once (see skip_short_runs)
+TEXT_SYMBOL_CLASS = 1
+ONE_SYMBOL_WORD_CLASS = 2
+SPACE_VALUE = ord(SPACE)
+LEFT_PUNCTUATION_VALUE = ord(LEFT_PUNCTUATIONS)
+DOT_VALUE = ord('.')
+# ascii uppercase and lowercase letters differ only in this bit
+LOWERCASE_BIT = ord('a') - ord('A')
 
 
 class Text(object):
+    __slots__ = ('start_index', 'text')
 
     def __init__(self, start_index: int, text: str) -> None:
         """
@@ -20,258 +66,893 @@ class Text(object):
         self.start_index = start_index
         self.text = text
 
-    def clear(self) -> None:
-        self.start_index = -1
-        self.text = EMPTY
+
+def word_records_dtype() -> np.dtype:
+    """
+    The words found in the channels are kept in np arrays of records of this dtype: their start_index,
+    the channel they were found in and their text. The text of a word is at most as long as the longest word
+    of the dictionary, with a left punctuation before it and '...' after it.
+    """
+    max_text_length = dictionary.english_dictionary.max_word_length + len(LEFT_PUNCTUATIONS) + len(ELLIPSIS)
+    return np.dtype([('start_index', np.int64), ('channel', np.uint8), ('text', f'S{max_text_length}')])
 
 
-def get_valid_symbol_combinations_of_channel(channel: [str]) -> [[Text]]:
+def texts_of_channel(channel: np.ndarray, starts: np.ndarray, lengths: np.ndarray, width: int) -> np.ndarray:
     """
-    :param channel: List of ascii symbols that were hidden in LSB channel of the image.
-    :return: List of all the valid texts was found.
+    This function gathers the texts channel[start:start + length] of all the given texts at once.
+    :return: The texts as a np array of fixed width bytes (zero padded, so a text is never longer than width).
     """
-    possible_letter_combinations = []
-    current_combination = Text(start_index=-1, text=EMPTY)
+    if not len(starts):
+        return np.empty(0, dtype=f'S{width}')
+    offsets = np.arange(width)
+    indices = np.minimum(starts[:, None] + offsets, len(channel) - 1)
+    texts = channel[indices]
+    texts[offsets >= lengths[:, None]] = 0
+    return texts.view(f'S{width}').reshape(-1)
 
-    for index, char in enumerate(channel):
-        if char in config.VALID_TEXT_SYMBOLS_LETTERS:
-            if char == SPACE:
-                if not current_combination.text == EMPTY:
-                    possible_letter_combinations.append(copy.deepcopy(current_combination))
-                    current_combination.clear()
-                possible_letter_combinations.append(Text(index, SPACE))
-            else:
-                current_combination.text += char
-                if current_combination.start_index == -1:
-                    current_combination.start_index = index
-        else:
-            if not current_combination.text == EMPTY:
-                possible_letter_combinations.append(copy.deepcopy(current_combination))
-                current_combination.clear()
 
-    if not current_combination.text == EMPTY:
-        possible_letter_combinations.append(current_combination)
+def get_valid_symbol_combinations_of_channel(channel: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    This function finds all the valid texts of the channel: every sequence of letters, and every space.
+    :param channel: The ascii values that were hidden in LSB channel of the image.
+    :return: The start index and the length of each of the texts, sorted by the start indices.
+    """
+    is_letter = np.concatenate(([False], IS_LETTER[channel], [False]))
+    # A sequence of letters starts where a letter comes after a non-letter, and ends where a non-letter comes
+    letters_edges = np.flatnonzero(is_letter[1:] != is_letter[:-1])
+    letters_starts = letters_edges[0::2]
+    spaces_starts = np.flatnonzero(channel == SPACE_VALUE)
 
-    return possible_letter_combinations
+    starts = np.concatenate((letters_starts, spaces_starts))
+    lengths = np.concatenate((letters_edges[1::2] - letters_starts, np.ones(len(spaces_starts), dtype=np.int64)))
+    order = np.argsort(starts, kind='stable')
+    return starts[order], lengths[order]
 
 
-def remove_non_valid_one_letter_words(words: [Text]) -> [Text]:
+def remove_non_valid_one_letter_words(channel: np.ndarray, starts: np.ndarray,
+                                      lengths: np.ndarray) -> (np.ndarray, np.ndarray):
     """
-    This function filter out all non-valid one-letter words from the given texts list.
+    This function filter out all non-valid one-letter words from the given texts.
     In English, there are only 2 one-letter words: "I" and "a".
     Each text that isn't one of those, or a space will be filtered out.
     """
-    filtered_words = []
-    for word in words:
-        if not len(word.text) == 1:
-            filtered_words.append(word)
-            continue
-        elif word.text.lower() in ['a', 'i', ' ']:
-            filtered_words.append(word)
-    return filtered_words
+    first_symbols = channel[starts]
+    is_valid = (lengths != 1) | IS_ONE_LETTER_WORD[first_symbols] | (first_symbols == SPACE_VALUE)
+    return starts[is_valid], lengths[is_valid]
 
 
-def probably_english_word(word: Text) -> Text or None:
+def remove_non_english_words(channel: np.ndarray, starts: np.ndarray,
+                             lengths: np.ndarray) -> (np.ndarray, np.ndarray):
     """
-    Notice - our MOST_COMMON_ENGLISH_WORDS list is lowercase.
-    :param word: Combination of readable symbols with text which is not '' and not  ' '.
-    :return: What is most likely to be the word in english of the given text, or None if nothing was found.
+    This function filters out from the given texts all the words that are not
+    common words in English according to the dictionary (by default, the one in the config.py file).
+    All the words are looked up in the dictionary at once.
+
+    A real English word might have had an extra letter added by chance before or after it.
+    So if a word isn't in the dictionary, but it is without its first or its last letter, that is the word kept
+    (the more common one, if both are).
+    """
+    english_dictionary = dictionary.english_dictionary
+    is_space = channel[starts] == SPACE_VALUE
+    # Longer words can't be in the dictionary, even without an extra letter
+    may_be_word = ~is_space & (lengths <= english_dictionary.max_word_length + 1)
+    words_starts, words_lengths = starts[may_be_word], lengths[may_be_word]
+
+    # Notice - our dictionary is lowercase
+    lowercase_channel = channel | np.uint8(LOWERCASE_BIT)
+    width = english_dictionary.max_word_length + 1
+    ranks = english_dictionary.ranks_of(texts_of_channel(lowercase_channel, words_starts, words_lengths, width))
+    ranks_without_first_letter = english_dictionary.ranks_of(
+        texts_of_channel(lowercase_channel, words_starts + 1, words_lengths - 1, width))
+    ranks_without_last_letter = english_dictionary.ranks_of(
+        texts_of_channel(lowercase_channel, words_starts, words_lengths - 1, width))
+
+    is_word = ranks != NOT_FOUND
+    is_word_without_first_letter = ~is_word & (ranks_without_first_letter != NOT_FOUND) & (
+            (ranks_without_last_letter == NOT_FOUND) | (ranks_without_first_letter <= ranks_without_last_letter))
+    is_word_without_last_letter = ~is_word & ~is_word_without_first_letter & (ranks_without_last_letter != NOT_FOUND)
+
+    is_english = is_word | is_word_without_first_letter | is_word_without_last_letter
+    words_starts = (words_starts + is_word_without_first_letter)[is_english]
+    words_lengths = (words_lengths - ~is_word)[is_english]
+
+    # Capital letters can be only at the start of a word
+    num_of_uppercase_letters_before = np.concatenate(([0], np.cumsum(IS_UPPERCASE_LETTER[channel])))
+    is_valid = (num_of_uppercase_letters_before[words_starts + words_lengths] ==
+                num_of_uppercase_letters_before[words_starts + 1])
+    words_starts, words_lengths = words_starts[is_valid], words_lengths[is_valid]
+
+    starts = np.concatenate((starts[is_space], words_starts))
+    lengths = np.concatenate((lengths[is_space], words_lengths))
+    order = np.argsort(starts, kind='stable')
+    return starts[order], lengths[order]
+
+
+def add_punctuations_if_exists(channel: np.ndarray, starts: np.ndarray,
+                               lengths: np.ndarray) -> (np.ndarray, np.ndarray):
     """
-    text = word.text
-    text_lower = text.lower()
-    start_index = word.start_index
+    This function gets all legal words in English that were hidden in an LSB channel,
+    and the ascii values that were hidden in this LSB channel.
 
-    if text_lower in config.MOST_COMMON_ENGLISH_WORDS_LOWERCASE:
-        return word
+    Based on these two, it adds to each word punctuations that were hidden in the channel,
+    punctuations that are placed just before or after the word.
+    Because the text of a word is always the symbols of the channel from its start to its end,
+    adding the punctuations only moves its start or its end.
+    """
+    if not len(starts):
+        return starts, lengths
+    last_index = len(channel) - 1
+    previous_indices = starts - 1
+    next_indices = starts + lengths
+
+    # Handling (
+    has_left_punctuation = (previous_indices >= 0) & (
+            channel[np.maximum(previous_indices, 0)] == LEFT_PUNCTUATION_VALUE)
+    # Handling )!?.,
+    has_right_punctuation = (next_indices <= last_index) & IS_RIGHT_PUNCTUATION[
+        channel[np.minimum(next_indices, last_index)]]
+    # Handling ...
+    has_ellipsis = next_indices + 2 <= last_index
+    for i in range(len(ELLIPSIS)):
+        has_ellipsis &= channel[np.minimum(next_indices + i, last_index)] == DOT_VALUE
+
+    num_of_symbols_after = np.where(has_ellipsis, len(ELLIPSIS), has_right_punctuation)
+    return starts - has_left_punctuation, lengths + has_left_punctuation + num_of_symbols_after
+
+
+def longest_strike(all_words: [Text]) -> [Text]:
+    """
+    This function calculate and returns the longest strike of words and spaces (sentence)
+    in the given words, that are sorted by their start_index.
+
+    A word can be continued by every word that starts where it ends (because we combined 3 hidden channels,
+    there may be up to 3 such words). Also, after every English word there must be a space,
+    and after every space there must be an English word (so that we get a proper sentence).
+
+    The length of the longest strike starting from each word is calculated once, from the last word to
+    the first one, based on the strikes of the words that can continue it (which were already calculated).
+    Each word keeps a link to the word that continues its longest strike, so the strike is built by
+    following the links. If several strikes are the longest, the one that starts first
+    (and continues by the first words) is chosen.
+    """
+    words_starting_at = {}
+    for i, word in enumerate(all_words):
+        words_starting_at.setdefault(word.start_index, []).append(i)
+
+    strike_lengths = [0] * len(all_words)
+    next_words = [-1] * len(all_words)
+    for i in reversed(range(len(all_words))):
+        is_space = all_words[i].text == SPACE
+        next_start_index_should_be = all_words[i].start_index + len(all_words[i].text)
+        next_word = -1
+        for j in words_starting_at.get(next_start_index_should_be, []):
+            if (all_words[j].text == SPACE) == is_space:
+                continue
+            if next_word == -1 or strike_lengths[j] > strike_lengths[next_word]:
+                next_word = j
+        next_words[i] = next_word
+        strike_lengths[i] = 1 + (strike_lengths[next_word] if next_word != -1 else 0)
+
+    # A sentence starts with a word (not with a space)
+    first_word = -1
+    for i in range(len(all_words)):
+        if all_words[i].text != SPACE and (first_word == -1 or strike_lengths[i] > strike_lengths[first_word]):
+            first_word = i
 
-    for word in config.MOST_COMMON_ENGLISH_WORDS_LOWERCASE:
-        if word == text_lower:
-            return word
-        if word in text_lower:
-            if len(text_lower) - len(word) <= 1:
-                if text_lower[1:] == word:
-                    return Text(start_index + 1, text[1:])
-                return Text(start_index, text[:-1])
-    return None
+    strike = []
+    while first_word != -1:
+        strike.append(all_words[first_word])
+        first_word = next_words[first_word]
+    return strike
 
 
-def remove_non_english_words(words: [Text]) -> [Text]:
+def longest_sentence(all_words: [Text]) -> str:
     """
-    This function filters out from the given list all the words that are not
-    common words in English according to the dictionary in the config.py file.
+    This function calculate and returns the longest sentence in English that
+    was hidden in the image.
     """
-    filtered_words = []
+    return ''.join([word.text for word in longest_strike(all_words)])
 
-    for word in words:
-        if word.text == SPACE:
-            filtered_words.append(word)
 
-        english_word = probably_english_word(word)
+def one_symbol_words_lookup_table() -> np.ndarray:
+    """
+    This function returns a lookup table (see symbols_lookup_table) of the symbols that can be a word of one symbol:
+    a space, and the letters (in both cases) that are words of the dictionary.
+    """
+    letters = np.array(list(VALID_LOWERCASE_LETTERS))
+    one_letter_words = ''.join(letters[dictionary.english_dictionary.ranks_of(letters) != NOT_FOUND])
+    return symbols_lookup_table(f"{SPACE}{one_letter_words}{one_letter_words.upper()}")
 
-        if english_word:
-            # Capital letters can be only at the start of a word
-            word_is_valid = True
-            for letter in english_word.text[1:]:
-                if letter in VALID_UPPERCASE_LETTERS:
-                    word_is_valid = False
-                    break
-            if word_is_valid:
-                filtered_words.append(english_word)
 
-    return filtered_words
+def is_in_text_window(symbols_of_channels: np.ndarray, window: int = config.PRERANK_WINDOW_SYMBOLS,
+                      min_text_symbols: int = config.PRERANK_MIN_TEXT_SYMBOLS) -> np.ndarray:
+    """
+    Each window of window indices is scored by the number of its indices in which one of the
+    channels has a common text symbol (a lowercase letter, a space or a punctuation). Almost all the symbols of
+    an English text are such (a sentence may move between the channels, but in each of its indices one of them
+    has it), while in noise about a third of the indices are. The windows are scored at once, with a cumulative
+    sum of the scores of the indices.
+
+    This function returns for each index whether a window with at least min_text_symbols common text symbols
+    covers it.
+    :param symbols_of_channels: uint-8 array of shape (MAX_HIDE_CHANNELS, N).
+    """
+    num_of_symbols = symbols_of_channels.shape[1]
+    num_of_windows = num_of_symbols - window + 1
+    if num_of_windows <= 0:
+        return np.zeros(num_of_symbols, dtype=bool)
+    scores = np.zeros(num_of_symbols + 1, dtype=np.int32)
+    np.cumsum(IS_COMMON_TEXT_SYMBOL[symbols_of_channels].any(axis=0), out=scores[1:])
+    is_text_window = scores[window:] - scores[:-window] >= min_text_symbols
+    # An index is covered if one of the windows that cover it (the ones that start up to window - 1 indices
+    # before it) looks like text
+    text_windows = np.empty(num_of_symbols + 1, dtype=np.int32)
+    text_windows[0] = 0
+    np.cumsum(is_text_window, out=text_windows[1:num_of_windows + 1])
+    text_windows[num_of_windows + 1:] = text_windows[num_of_windows]
+    is_covered = np.empty(num_of_symbols, dtype=bool)
+    is_covered[:window - 1] = text_windows[1:window] > 0
+    is_covered[window - 1:] = text_windows[window:] > text_windows[:num_of_windows]
+    return is_covered
+
+
+class OffsetDecodingState(object):
+
+    def __init__(self, offset: int = 0, profile: DecodeProfile = NO_PROFILE, progressive: bool = False,
+                 prerank: bool = False) -> None:
+        """
+        This class holds the state of decoding the symbols that were hidden starting from one offset,
+        while the symbols are given strip by strip (so words and sentences may cross the strips).
+
+        For each channel, the symbols from which words weren't found yet are carried to the next strip.
+        The words found are merged (sorted by their start_index) with the words of the other channels,
+        and grouped to segments of words that may continue each other. A sentence can't cross a segment,
+        so only the longest strike of each closed segment is kept.
+
+        In progressive mode, the symbols of a strip that can't be a part of a strike longer than the best
+        strike found so far are skipped (see skip_short_runs), so they don't go through the rest of the decoding.
+        If prerank, the windows of symbols of each channel that don't look like text are skipped too
+        (see skip_noise_windows).
+        :param offset: The offset, for recording the stages of its decoding in the profile.
+        :param profile: A profile to record the stages of the decoding in.
+        :param progressive: Whether to skip the symbols that can't change the best strike.
+        :param prerank: Whether to skip the windows of symbols that are scored as noise.
+        """
+        self.offset = offset
+        self.profile = profile
+        self.progressive = progressive
+        self.prerank = prerank
+        self.symbols_classes = (IS_TEXT_SYMBOL * np.uint8(TEXT_SYMBOL_CLASS) |
+                                one_symbol_words_lookup_table() * np.uint8(ONE_SYMBOL_WORD_CLASS))
+        self.words_dtype = word_records_dtype()
+        self.carried_symbols = [np.empty(0, dtype=np.uint8) for _ in range(MAX_HIDE_CHANNELS)]
+        # Global index of the first symbol of each channel that words starting from weren't found yet
+        self.first_open_index = [0] * MAX_HIDE_CHANNELS
+        self.pending_words = np.empty(0, dtype=self.words_dtype)
+        self.segment = np.empty(0, dtype=self.words_dtype)
+        self.best_strike = []
+
+    def feed(self, symbols_of_channels: np.ndarray, is_last: bool) -> None:
+        """
+        Adds the next symbols of each channel.
+        :param symbols_of_channels: uint-8 array of the next ascii values of each LSB channel (channels x symbols).
+        :param is_last: Whether these are the last symbols of the channels.
+        """
+        if self.prerank:
+            symbols_of_channels = self.skip_noise_windows(symbols_of_channels, is_last)
+        if self.progressive and self.best_strike:
+            symbols_of_channels = self.skip_short_runs(symbols_of_channels, is_last)
+        words_of_channels = [self.pending_words]
+        for i in range(MAX_HIDE_CHANNELS):
+            base_index = max(self.first_open_index[i] - 1, 0)
+            symbols = np.concatenate((self.carried_symbols[i], symbols_of_channels[i]))
+            starts, texts, self.first_open_index[i] = words_of_channel_strip(
+                symbols, base_index, self.first_open_index[i], is_last, self.words_dtype['text'].itemsize,
+                self.profile, self.offset, i)
+            self.carried_symbols[i] = symbols[max(self.first_open_index[i] - 1, 0) - base_index:]
+
+            words = np.empty(len(starts), dtype=self.words_dtype)
+            words['start_index'] = starts
+            words['channel'] = i
+            words['text'] = texts
+            words_of_channels.append(words)
+
+        start_time = self.profile.clock()
+        words = np.concatenate(words_of_channels)
+        words = words[np.lexsort((words['channel'], words['start_index']))]
+        # Words of the next strips start at least at min(first_open_index) - 1 (because of a left punctuation),
+        # so all the words that start before it can be added in their final order.
+        num_of_ready_words = len(words)
+        if not is_last:
+            horizon = min(self.first_open_index) - len(LEFT_PUNCTUATIONS)
+            num_of_ready_words = np.searchsorted(words['start_index'], horizon)
+        self.pending_words = words[num_of_ready_words:]
+        self.profile.record('merge', start_time, self.offset, words=len(words))
+        self.add_words_to_segments(words[:num_of_ready_words], is_last)
+
+    def skip_noise_windows(self, symbols_of_channels: np.ndarray, is_last: bool) -> np.ndarray:
+        """
+        This function returns the given symbols, without (replaced by zeros) the indices that aren't in a window
+        that looks like text (see is_in_text_window), so most of the noise never gets to the word pipeline.
+        Unlike skip_short_runs this is a heuristic: a text of fewer than PRERANK_WINDOW_SYMBOLS symbols
+        (8, e.g. 'I am') may be skipped too.
+        The indices at the edges of the strip, whose windows may continue in the previous or the next strip,
+        are kept.
+        """
+        start_time = self.profile.clock()
+        window = config.PRERANK_WINDOW_SYMBOLS
+        num_of_symbols = symbols_of_channels.shape[1]
+        if num_of_symbols < window:
+            return symbols_of_channels
+        is_kept = is_in_text_window(symbols_of_channels)
+        is_kept[:window - 1] = True
+        if not is_last:
+            is_kept[-(window - 1):] = True
+        self.profile.record('prerank', start_time, self.offset, symbols=num_of_symbols,
+                            skipped_symbols=num_of_symbols - int(np.count_nonzero(is_kept)))
+        return symbols_of_channels * is_kept
+
+    def skip_short_runs(self, symbols_of_channels: np.ndarray, is_last: bool) -> np.ndarray:
+        """
+        A strike covers a run of consecutive symbol indices, and in each of them at least one of the channels
+        has a text symbol (a letter, a space or a punctuation). Each word of the strike covers at least 2 indices,
+        except spaces and one-letter words, that cover one index. So a run of n indices, q of which can be
+        a one symbol word, can't hold a strike of more than (n + q) / 2 words.
+
+        This function returns the given symbols, without (replaced by zeros) the runs that can't hold a strike
+        longer than the best strike found so far, so they can't change it. This is much cheaper than finding
+        their words. Runs that touch the edges of the strip may continue in the previous or the next strip,
+        so they are kept.
+        """
+        start_time = self.profile.clock()
+        num_of_symbols = symbols_of_channels.shape[1]
+        # The classes of the symbols of all the channels in each index, in a single lookup
+        classes = np.bitwise_or.reduce(self.symbols_classes[symbols_of_channels], axis=0)
+        is_text = np.concatenate(([False], (classes & TEXT_SYMBOL_CLASS).astype(bool), [False]))
+        runs_edges = np.flatnonzero(is_text[1:] != is_text[:-1])
+        runs_starts, runs_ends = runs_edges[0::2], runs_edges[1::2]
+        one_symbol_words_indices = np.flatnonzero(classes & ONE_SYMBOL_WORD_CLASS)
+        num_of_one_symbol_words = (np.searchsorted(one_symbol_words_indices, runs_ends) -
+                                   np.searchsorted(one_symbol_words_indices, runs_starts))
+        max_strike_lengths = (runs_ends - runs_starts + num_of_one_symbol_words) // 2
+        is_short = (max_strike_lengths <= len(self.best_strike)) & (runs_starts > 0)
+        if not is_last:
+            is_short &= runs_ends < num_of_symbols
+        runs_starts, runs_ends = runs_starts[is_short], runs_ends[is_short]
+
+        if len(runs_starts):
+            # +1 where a short run starts and -1 where it ends, so the running sum is 1 exactly inside short runs
+            short_runs_edges = np.zeros(num_of_symbols + 1, dtype=np.int8)
+            short_runs_edges[runs_starts] = 1
+            short_runs_edges[runs_ends] -= 1
+            is_kept = 1 - np.cumsum(short_runs_edges[:-1], dtype=np.int8).view(np.uint8)
+            symbols_of_channels = symbols_of_channels * is_kept
+        self.profile.record('skip', start_time, self.offset, runs=len(runs_edges) // 2,
+                            skipped_runs=len(runs_starts), skipped_symbols=np.sum(runs_ends - runs_starts))
+        return symbols_of_channels
+
+    def add_words_to_segments(self, words: np.ndarray, is_last: bool) -> None:
+        """
+        Adds the next words (sorted) to the current segment, and closes every segment that they end.
+        """
+        start_time = self.profile.clock()
+        words = np.concatenate((self.segment, words))
+        if not len(words):
+            return
+        ends = words['start_index'] + np.char.str_len(words['text'])
+        # A word that starts after all the words before it ended can't continue any of them
+        max_end_before = np.concatenate(([-1], np.maximum.accumulate(ends)[:-1]))
+        segments_starts = np.flatnonzero(words['start_index'] > max_end_before)
+        segments_ends = np.append(segments_starts[1:], len(words))
+
+        if not is_last:
+            # The last segment may be continued by words of the next strips
+            self.segment = words[segments_starts[-1]:]
+            segments_starts, segments_ends = segments_starts[:-1], segments_ends[:-1]
+
+        # The strike of a segment is at most as long as the number of its words
+        may_be_longer = segments_ends - segments_starts > len(self.best_strike)
+        self.profile.record('segments', start_time, self.offset, words=len(words), segments=len(segments_starts))
+        for segment_start, segment_end in zip(segments_starts[may_be_longer], segments_ends[may_be_longer]):
+            if segment_end - segment_start > len(self.best_strike):
+                self.close_segment(words[segment_start:segment_end])
+
+    def close_segment(self, segment: np.ndarray) -> None:
+        start_time = self.profile.clock()
+        strike = longest_strike([Text(int(word['start_index']), word['text'].decode('ascii')) for word in segment])
+        if len(strike) > len(self.best_strike):
+            self.best_strike = strike
+        self.profile.record('sentence', start_time, self.offset, words=len(segment), edges=count_edges(segment))
+
+    def hidden_text(self) -> str:
+        return ''.join([word.text for word in self.best_strike])
+
+
+def count_edges(words: np.ndarray) -> int:
+    """
+    This function counts the edges of the graph of the given words (sorted by their start_index),
+    where each word is connected to every word that starts right where it ends.
+    """
+    if not len(words):
+        return 0
+    starts = words['start_index']
+    ends = starts + np.char.str_len(words['text'])
+    return int(np.sum(np.searchsorted(starts, ends, 'right') - np.searchsorted(starts, ends, 'left')))
 
 
-def add_punctuations_if_exists(words: [Text], symbols_of_channel: [str]) -> [Text]:
+def words_of_channel_strip(symbols: np.ndarray, base_index: int, first_open_index: int, is_last: bool, width: int,
+                           profile: DecodeProfile = NO_PROFILE, offset: int = None,
+                           channel: int = None) -> (np.ndarray, np.ndarray, int):
     """
-    This function gets a list of all legal words in English that were hidden in an LSB channel.
-    It also gets the list of symbols were hidden in this LSB channel.
-
-    Based on these two, it adds to each word punctuations that were hidden in the channel,
-    punctuations that are placed just before or after the word.
+    This function finds the English words (with their punctuations) in a strip of symbols of one channel.
+    :param symbols: The ascii values of the strip (including the symbols carried from the previous strip).
+    :param base_index: The global index of the first symbol of the strip.
+    :param first_open_index: Words starting before this global index were already found in previous strips.
+    :param is_last: Whether the strip ends the channel.
+    :param width: The maximal length of the text of a word.
+    :param profile: A profile to record the stages in, as stages of the given offset and channel.
+    :return: The global start indices and the texts of the words that can be completely found in this strip,
+    and the global index from which words should be looked for in the next strip.
     """
-    words_with_punctuations = []
-    for word in words:
-        previous_index = word.start_index - 1
-        next_index = word.start_index + len(word.text)
-
-        # Handling (
-        if previous_index >= 0:
-            if symbols_of_channel[previous_index] == LEFT_PUNCTUATIONS:
-                word.start_index = previous_index
-                word.text = symbols_of_channel[previous_index] + word.text
+    start_time = profile.clock()
+    starts, lengths = get_valid_symbol_combinations_of_channel(symbols)
+    is_new = starts >= first_open_index - base_index
+    starts, lengths = starts[is_new], lengths[is_new]
+
+    # The punctuations after a word are checked up to 3 symbols after it ('...')
+    is_complete = is_last | (starts + lengths + len(ELLIPSIS) <= len(symbols))
+    # Too long to be an English word (even with an extra letter), no matter how it continues
+    may_be_word = lengths <= dictionary.english_dictionary.max_word_length + 1
+    is_open = ~is_complete & may_be_word
+    next_open_index = base_index + (starts[is_open][0] if is_open.any() else len(symbols))
+    starts, lengths = starts[is_complete], lengths[is_complete]
+    profile.record('tokenize', start_time, offset, channel, symbols=len(symbols), tokens=len(starts))
+
+    start_time = profile.clock()
+    starts, lengths = remove_non_valid_one_letter_words(symbols, starts, lengths)
+    starts, lengths = remove_non_english_words(symbols, starts, lengths)
+    profile.record('dictionary', start_time, offset, channel, words=len(starts))
+
+    start_time = profile.clock()
+    starts, lengths = add_punctuations_if_exists(symbols, starts, lengths)
+    texts = texts_of_channel(symbols, starts, lengths, width)
+    profile.record('punctuation', start_time, offset, channel, words=len(starts))
+    return base_index + starts, texts, int(next_open_index)
+
+
+def guess_hidden_text(symbols_of_channels: [[str]] or np.ndarray, profile: DecodeProfile = NO_PROFILE,
+                      prerank: bool = True) -> str:
+    """
+    This function calculates and returns the longest sentence that was hidden in all relevant LSB channels.
+    If a profile is given, the stages of the calculation are recorded in it.
+    If prerank, the windows of the channels that are scored as noise are skipped (see skip_noise_windows).
+    """
+    if not isinstance(symbols_of_channels, np.ndarray):
+        symbols_of_channels = np.array([[ord(symbol) for symbol in symbols] for symbols in symbols_of_channels],
+                                       dtype=np.uint8).reshape(len(symbols_of_channels), -1)
+    state = OffsetDecodingState(profile=profile, prerank=prerank)
+    state.feed(symbols_of_channels, is_last=True)
+    return state.hidden_text()
 
-        # Handling )!?.,
-        if next_index < len(symbols_of_channel):
-            if symbols_of_channel[next_index] in RIGHT_PUNCTUATIONS:
-                word.text = word.text + symbols_of_channel[next_index]
 
-        # Handling ...
-        if next_index + 2 < len(symbols_of_channel):
-            next_three_symbols = symbols_of_channel[next_index] + \
-                                 symbols_of_channel[next_index + 1] + \
-                                 symbols_of_channel[next_index + 2]
-            if next_three_symbols == '...':
-                # Because we already added one dot when handled )!?., we ignore it by word.text[:-1]
-                word.text = word.text[:-1] + next_three_symbols
+def get_hidden_symbols_of_all_offsets(colors: np.ndarray, offsets: [int] = None) -> np.ndarray:
+    """
+    This function extracts, in one pass over the colors, the ascii values that were hidden in each LSB channel,
+    as if the text was hidden starting from each of the first 8 colors (offsets).
 
-        words_with_punctuations.append(word)
+    Each LSB channel (bit plane) is extracted and packed only once. The packing as if the text started
+    from offset i is then built from it by shifting: the symbol k of offset i is made of the last 8 - i bits
+    of byte k and the first i bits of byte k + 1 of the packing from offset 0.
 
-    return words_with_punctuations
+    :param colors: The colors (bytes) of the image, in any shape.
+    :param offsets: Only these offsets are extracted (all of them if not given).
+    :return: uint-8 array of shape (offsets, MAX_HIDE_CHANNELS, N), where N is the number of symbols of offset 0.
+    Offsets with fewer complete symbols are padded at the end with zeros, which are not text symbols.
+    """
+    offsets = range(NUM_OF_BITS_IN_ASCII_SYMBOL) if offsets is None else offsets
+    colors = colors.reshape(-1)
+    num_of_symbols = colors.size // NUM_OF_BITS_IN_ASCII_SYMBOL
+    symbols = np.zeros((len(offsets), MAX_HIDE_CHANNELS, num_of_symbols), dtype=np.uint8)
+
+    for channel in range(MAX_HIDE_CHANNELS):
+        # Get the LSB-channel of each color (byte) in the image, and combine each 8 bits to a uint-8
+        packed_bit_plane = np.packbits(colors & utils.set_bit_1(0, channel))
+        for i, offset in enumerate(offsets):
+            if not offset:
+                symbols[i, channel] = packed_bit_plane[:num_of_symbols]
+                continue
+            num_of_offset_symbols = (colors.size - offset) // NUM_OF_BITS_IN_ASCII_SYMBOL
+            high_bits = packed_bit_plane[:num_of_offset_symbols] << offset
+            low_bits = packed_bit_plane[1:num_of_offset_symbols + 1] >> (NUM_OF_BITS_IN_ASCII_SYMBOL - offset)
+            np.bitwise_or(high_bits, low_bits, out=symbols[i, channel, :num_of_offset_symbols])
+
+    return symbols
 
 
-# noinspection PyTypeChecker
-def longest_sentence_from_word(i: int, all_words: [Text], should_be_space=False) -> [Text]:
+def get_hidden_ascii_symbols_of_channels_from_image_as_np_array(image_as_np_array: np.ndarray, start_index) -> [[str]]:
     """
-    This recursive function, returns the longest strike of words and spaces starting from a specific word.
+    This function creates and returns a list of all hidden ascii symbols were hidden in the image,
+    in all relevant LSB channels, as if the text was hidden starting from the color start_index.
+    """
+    colors = image_as_np_array.reshape(-1)[start_index:]
+    # Only offset 0, the text starts at start_index
+    symbols_of_channels = get_hidden_symbols_of_all_offsets(colors, offsets=[0])[0]
+    # Convert each uint-8 to its ascii representation (string)
+    return [list(map(chr, symbols)) for symbols in symbols_of_channels]
 
-    It looks at the start_index of the words, and based on the size of the word,
-    calculates the index where the next word should be.
 
-    Also, a check is made that after every English word there is a space,
-    and after every space there is an English word (so that we get a proper sentence)
+def iter_colors_strips(row_strips: [np.ndarray]) -> (np.ndarray, bool):
     """
-    current_word = all_words[i]
-
-    if all_words[i].text == SPACE and not should_be_space:
-        return []
-    if all_words[i].text != SPACE and should_be_space:
-        return []
+    This function joins the given strips of the image (in any shape) to one flat sequence of colors,
+    and yields it in strips that start at a multiple of NUM_OF_BITS_IN_ASCII_SYMBOL colors.
+    Each yielded strip starts right after the last complete symbol of the previous strip in all 8 offsets,
+    so the symbols of each offset continue exactly from where they stopped.
+    :return: Tuples of (colors strip, whether it is the last strip).
+    """
+    leftover_colors = np.empty(0, dtype=np.uint8)
+    for row_strip in row_strips:
+        colors = np.concatenate((leftover_colors, row_strip.reshape(-1)))
+        yield colors, False
+        # The symbols of offset 7 in the strip ended here (the other offsets may have one more symbol)
+        num_of_symbols = max(colors.size - (NUM_OF_BITS_IN_ASCII_SYMBOL - 1), 0) // NUM_OF_BITS_IN_ASCII_SYMBOL
+        leftover_colors = colors[num_of_symbols * NUM_OF_BITS_IN_ASCII_SYMBOL:].copy()
+    yield leftover_colors, True
 
-    # Because we combined 3 hidden channels (of 3 LSBs) we may have up to 3 options to continue the strike
-    possible_options_to_continue = []
-    next_start_index_should_be = all_words[i].start_index + len(all_words[i].text)
 
-    for j in range(i + 1, len(all_words)):
-        if all_words[j].start_index < next_start_index_should_be:
-            continue
-        if all_words[j].start_index > next_start_index_should_be:
-            break
-        possible_options_to_continue.append(j)
+def profiled_strips(row_strips: [np.ndarray], profile: DecodeProfile) -> np.ndarray:
+    """
+    This function yields the given strips, and records the time of getting each of them (reading it from
+    the file, when the image is read strip by strip) in the profile.
+    """
+    row_strips = iter(row_strips)
+    while True:
+        start_time = profile.clock()
+        row_strip = next(row_strips, None)
+        if row_strip is None:
+            return
+        profile.record('read', start_time, colors=row_strip.size)
+        yield row_strip
 
-    possible_strikes = [longest_sentence_from_word(j, all_words, not should_be_space) for j in
-                        possible_options_to_continue]
 
-    return [current_word] if possible_strikes == [] else [current_word] + max(possible_strikes, key=len)
+def growing_strips(row_strips: [np.ndarray], first_strip_colors: int) -> np.ndarray:
+    """
+    This function yields the colors of the given strips, while splitting their beginning to strips that
+    start from first_strip_colors colors, and grow twice as big each time (until they are as big as the given strips).
+    """
+    strip_colors = first_strip_colors
+    for row_strip in row_strips:
+        colors = row_strip.reshape(-1)
+        while strip_colors < colors.size:
+            yield colors[:strip_colors]
+            colors = colors[strip_colors:]
+            strip_colors *= 2
+        yield colors
+
+
+def decode_strips(row_strips: [np.ndarray], profile: DecodeProfile = NO_PROFILE, progressive: bool = True,
+                  prerank: bool = True) -> str:
+    """
+    This function decodes an image that is given strip by strip (see decode),
+    so only one strip of the image (and the words found in it) is in memory at any time.
+
+    In progressive mode, the image is decoded from small strips that grow, and only the symbols that may
+    be a part of a longer sentence than the one found so far are decoded completely (see skip_short_runs).
+    A hidden text usually starts at the beginning of the image, so once it is found, the rest of the image
+    is mostly skipped, and the time of decoding depends mostly on the size of the text.
+    The guess is exactly the same as without progressive mode.
+
+    If prerank, the windows of symbols that are scored as noise are skipped before looking for words in them
+    (see skip_noise_windows), which is much faster, but may miss texts of fewer than PRERANK_WINDOW_SYMBOLS
+    (8) symbols. Otherwise (exhaustive mode) all the symbols are decoded.
+    """
+    return best_guess(decode_offsets(row_strips, range(NUM_OF_BITS_IN_ASCII_SYMBOL), profile, progressive,
+                                     prerank))
 
 
-def longest_sentence(all_words: [Text]) -> str:
+def decode_offsets(row_strips: [np.ndarray], offsets: [int], profile: DecodeProfile = NO_PROFILE,
+                   progressive: bool = True, prerank: bool = True) -> [str]:
     """
-    This function calculate and returns the longest sentence in English that
-    was hidden in the image.
+    This function decodes an image that is given strip by strip (see decode_strips), only from the given offsets.
+    :return: The best guess of each of the offsets.
+    """
+    states = [OffsetDecodingState(offset, profile, progressive, prerank) for offset in offsets]
+    row_strips = profiled_strips(row_strips, profile)
+    if progressive:
+        row_strips = growing_strips(row_strips, config.FIRST_DECODE_STRIP_COLORS)
+    for colors, is_last in iter_colors_strips(row_strips):
+        start_time = profile.clock()
+        symbols = get_hidden_symbols_of_all_offsets(colors, offsets)
+        if not is_last:
+            # Only the symbols that are complete in all offsets, the rest are in the next strip
+            num_of_symbols = max(colors.size - (NUM_OF_BITS_IN_ASCII_SYMBOL - 1), 0) // NUM_OF_BITS_IN_ASCII_SYMBOL
+            symbols = symbols[:, :, :num_of_symbols]
+        profile.record('extract', start_time, colors=colors.size, symbols=symbols.size)
+        for state, symbols_of_offset in zip(states, symbols):
+            state.feed(symbols_of_offset, is_last)
+    return [state.hidden_text() for state in states]
+
+
+def best_guess(guesses: [str]) -> str:
     """
-    max_strike_len = 0
-    longest_strike = []
+    This function returns the guess with the most words (the first of them, if there are a few).
+    """
+    max_words = 0
+    best_guess_text = ''
+    for guess in guesses:
+        if len(guess.split(SPACE)) > max_words:
+            max_words = len(guess.split(SPACE))
+            best_guess_text = guess
+    return best_guess_text
 
-    for i in range(len(all_words)):
-        current_longest_strike = longest_sentence_from_word(i, all_words)
-        current_strike_len = len(current_longest_strike)
-        if current_strike_len > max_strike_len:
-            max_strike_len = current_strike_len
-            longest_strike = copy.deepcopy(current_longest_strike)
 
-    return ''.join([word.text for word in longest_strike])
+def colors_strips(colors: np.ndarray, strip_size: int) -> np.ndarray:
+    return (colors[i:i + strip_size] for i in range(0, colors.size, strip_size))
 
 
-def guess_hidden_text(symbols_of_channels: [[str]]) -> str:
+def decode_offsets_of_shared_colors(shared_colors_name: str, num_of_colors: int, offsets: [int], strip_size: int,
+                                    progressive: bool, prerank: bool, profiled: bool) -> ([str], dict):
     """
-    This function calculates and returns the longest sentence that was hidden in all relevant LSB channels.
+    This function runs in a worker process of decode_shared_colors. It decodes the colors of the image,
+    that are in the given shared memory (so they aren't copied to the worker), from the given offsets.
+    :return: The best guess of each of the offsets, and the records of the profile of the decoding (if profiled).
+    """
+    shared_colors = shared_memory.SharedMemory(name=shared_colors_name)
+    try:
+        profile = DecodeProfile() if profiled else NO_PROFILE
+        colors = np.ndarray((num_of_colors,), dtype=np.uint8, buffer=shared_colors.buf)
+        guesses = decode_offsets(colors_strips(colors, strip_size), offsets, profile, progressive, prerank)
+        del colors
+        return guesses, profile.records
+    finally:
+        shared_colors.close()
+
+
+def decode_shared_colors(shared_colors: shared_memory.SharedMemory, num_of_colors: int, workers: int,
+                         strip_size: int = config.DEFAULT_DECODE_STRIP_COLORS, profile: DecodeProfile = NO_PROFILE,
+                         progressive: bool = True, prerank: bool = True) -> str:
     """
-    valid_text_channels = [[]] * len(symbols_of_channels)
+    This function decodes the colors of an image, that are in the given shared memory, over a pool of
+    worker processes. The 8 offsets are decoded independently of each other until the best guess of each
+    of them is found, so they are divided between the workers (up to 8 of them), and each worker reads the colors
+    from the shared memory, instead of getting a copy of them.
+    The guess is exactly the same as decoding the colors in a single process.
+    """
+    all_offsets = list(range(NUM_OF_BITS_IN_ASCII_SYMBOL))
+    offsets_of_workers = [all_offsets[i::workers] for i in range(min(workers, len(all_offsets)))]
+    initializer, initargs = (dictionary.use_wordlist, (dictionary.wordlist_path,)) if dictionary.wordlist_path \
+        else (None, ())
+    with ProcessPoolExecutor(max_workers=len(offsets_of_workers), initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = [executor.submit(decode_offsets_of_shared_colors, shared_colors.name, num_of_colors, offsets,
+                                   strip_size, progressive, prerank, profile is not NO_PROFILE)
+                   for offsets in offsets_of_workers]
+        results = [future.result() for future in futures]
+
+    guesses = [''] * len(all_offsets)
+    for offsets, (guesses_of_offsets, records) in zip(offsets_of_workers, results):
+        profile.add_records(records)
+        for offset, guess in zip(offsets, guesses_of_offsets):
+            guesses[offset] = guess
+    return best_guess(guesses)
+
+
+def decode_framed(row_strips: [np.ndarray], profile: DecodeProfile = NO_PROFILE,
+                  num_of_channels: int = framing.NUM_OF_RGB_CHANNELS) -> str:
+    """
+    This function returns the framed text that was hidden in the image (see framing.py),
+    reading only the strips of the image it is hidden in, and decompresses it if it was compressed.
+    :param num_of_channels: Number of channels of each pixel of the strips (3 for RGB, 4 for RGBA).
+    :raise framing.InvalidFrameError: If there is no framed text in the image.
+    :raise framing.ShardedPayloadError: If the framed text is only a shard of a text (see decode_shards).
+    """
+    start_time = profile.clock()
+    header, payload = framing.read_frame(row_strips, num_of_channels)
+    profile.record('frame', start_time, bytes=len(payload))
+    if header.flags & framing.FLAG_SHARD:
+        shard_header = framing.ShardHeader.from_bytes(payload)
+        raise framing.ShardedPayloadError(f"The image holds only shard {shard_header.index + 1} of the "
+                                          f"{shard_header.num_of_shards} shards of a text, "
+                                          f"decode it with the images of the other shards.")
+    if header.flags:
+        start_time = profile.clock()
+        payload = framing.decompress_payload(payload, header.flags)
+        profile.record('decompress', start_time, bytes=len(payload))
+    return payload.decode('latin-1')
+
+
+def decode_strip_size(max_memory: int = None, workers: int = 1) -> int:
+    """
+    This function returns the number of colors of each strip the image is decoded in, so the working memory
+    of decoding them (in all the workers together) is about max_memory bytes (if given).
+    """
+    if not max_memory:
+        return config.DEFAULT_DECODE_STRIP_COLORS
+    return max(max_memory // workers // config.DECODE_MEMORY_PER_COLOR, NUM_OF_BITS_IN_ASCII_SYMBOL)
 
-    for i in range(len(valid_text_channels)):
-        valid_text_channels[i] = get_valid_symbol_combinations_of_channel(symbols_of_channels[i])
-        valid_text_channels[i] = remove_non_valid_one_letter_words(valid_text_channels[i])
-        valid_text_channels[i] = remove_non_english_words(valid_text_channels[i])
-        valid_text_channels[i] = add_punctuations_if_exists(valid_text_channels[i], symbols_of_channels[i])
 
-    all_texts = [text for valid_text_channel in valid_text_channels for text in valid_text_channel]
-    all_texts.sort(key=lambda t: t.start_index)
+def decode_with_workers(num_of_colors: int, copy_colors, workers: int, max_memory: int = None,
+                        profile: DecodeProfile = NO_PROFILE, progressive: bool = True, prerank: bool = True) -> str:
+    """
+    This function puts the colors of the image in a shared memory, and decodes them over workers processes
+    (see decode_shared_colors).
+    :param copy_colors: A function that copies the colors of the image to the given array (of the shared memory).
+    """
+    shared_colors = shared_memory.SharedMemory(create=True, size=max(num_of_colors, 1))
+    try:
+        colors = np.ndarray((num_of_colors,), dtype=np.uint8, buffer=shared_colors.buf)
+        copy_colors(colors)
+        del colors
+        return decode_shared_colors(shared_colors, num_of_colors, workers, decode_strip_size(max_memory, workers),
+                                    profile, progressive, prerank)
+    finally:
+        shared_colors.close()
+        shared_colors.unlink()
+
+
+def decode(image_as_np_array: np.ndarray, max_memory: int = None, profile: DecodeProfile = NO_PROFILE,
+           progressive: bool = True, framed: bool = True, workers: int = None, prerank: bool = True) -> str:
+    """
+    This is the main logic function of decoding an image with hidden text in it.
+    It tries to find the best guess as if the text was hidden start from each byte in the image.
 
-    hidden_text = longest_sentence(all_texts)
-    return hidden_text
+    The image is decoded in strips of colors, that are small enough for the working memory
+    of decoding them to be about max_memory bytes (if given).
+    If a profile is given, the stages of the decoding are recorded in it.
+    See decode_strips for the progressive mode, and for prerank (and the exhaustive mode without it).
 
+    If framed, a framed text (see framing.py) is looked for first, and the best guess is calculated only
+    if there is none. An image of RGBA values (height x width x 4) is read as RGBA for the framed text,
+    and only its RGB colors are guessed (an unframed text is never hidden in the alpha channel).
 
-def get_hidden_ascii_symbols_of_channels_from_image_as_np_array(image_as_np_array: np.ndarray, start_index) -> [[str]]:
+    If workers (more than 1) is given, the image is copied to a shared memory, and decoded over this number of
+    worker processes (see decode_shared_colors).
     """
-    This function creates and returns a list of all hidden ascii symbols were hidden in the image,
-    in all relevant LSB channels.
+    colors = image_as_np_array.reshape(-1)
+    if framed:
+        num_of_channels = image_as_np_array.shape[-1] if image_as_np_array.ndim == 3 else framing.NUM_OF_RGB_CHANNELS
+        try:
+            return decode_framed((colors,), profile, num_of_channels)
+        except framing.InvalidFrameError:
+            pass
+    if image_as_np_array.ndim == 3 and image_as_np_array.shape[-1] > framing.NUM_OF_RGB_CHANNELS:
+        colors = image_as_np_array[:, :, :framing.NUM_OF_RGB_CHANNELS].reshape(-1)
+    if workers and workers > 1:
+        return decode_with_workers(colors.size, lambda shared_colors: np.copyto(shared_colors, colors), workers,
+                                   max_memory, profile, progressive, prerank)
+    return decode_strips(colors_strips(colors, decode_strip_size(max_memory)), profile, progressive, prerank)
+
+
+def decode_png_image(image_as_np_array: np.ndarray, profile: DecodeProfile = NO_PROFILE,
+                     progressive: bool = True, prerank: bool = True) -> str:
+    """
+    This function decodes an image that was loaded from a PNG file in its native mode
+    (see utils.png_file_to_np_array), the same way decode_png_file decodes the file:
+    the framed text (read as RGBA if the image is RGBA), and if there is none, the best guess of its RGB colors.
     """
-    image_as_np_array = image_as_np_array.flatten()
-    image_as_np_array = image_as_np_array[start_index:]
+    try:
+        return decode_framed((image_as_np_array,), profile, image_as_np_array.shape[2])
+    except framing.InvalidFrameError:
+        return decode(image_as_np_array[:, :, :framing.NUM_OF_RGB_CHANNELS], profile=profile,
+                      progressive=progressive, framed=False, prerank=prerank)
 
-    # To make the array divisible by NUM_OF_BITS_IN_ASCII_SYMBOL
-    num_of_colors_to_ignore_at_the_end = image_as_np_array.size % config.NUM_OF_BITS_IN_ASCII_SYMBOL
-    if num_of_colors_to_ignore_at_the_end:
-        image_as_np_array = image_as_np_array[:-num_of_colors_to_ignore_at_the_end]
 
-    hidden_ascii_symbols_of_channels = [copy.deepcopy(image_as_np_array) for _ in range(MAX_HIDE_CHANNELS)]
+def decode_bytes(image: bytes or np.ndarray, profile: DecodeProfile = NO_PROFILE, progressive: bool = True,
+                 prerank: bool = True) -> str:
+    """
+    This function decodes an image in memory, without reading any file (see decode_png_image),
+    e.g. an image that was received over the network or through a pipe.
+    :param image: The bytes of a PNG file (bytes, bytearray or memoryview), a file object of it,
+    or the image itself as a np array of RGB (or RGBA) values, which is decoded without copying it.
+    """
+    if not isinstance(image, np.ndarray):
+        start_time = profile.clock()
+        image = utils.png_file_to_np_array(utils.png_file_object(image))
+        profile.record('load', start_time, colors=image.size)
+    return decode_png_image(image, profile, progressive, prerank)
 
-    for i in range(MAX_HIDE_CHANNELS):
-        # Get the LSB-i of each color (byte) in the image
-        mask = utils.set_bit_1(0, i)
-        hidden_ascii_symbols_of_channels[i] = (hidden_ascii_symbols_of_channels[i] & mask)
-        # Combine each 8 bits to a uint-8
-        hidden_ascii_symbols_of_channels[i] = np.packbits(hidden_ascii_symbols_of_channels[i])
-        # Convert each uint-8 to its ascii representation (string)
-        hidden_ascii_symbols_of_channels[i] = list(map(chr, hidden_ascii_symbols_of_channels[i]))
 
-    return hidden_ascii_symbols_of_channels
+def framed_png_file_strips(png_file_path: str, max_memory: int = None) -> ([np.ndarray], int):
+    """
+    This function returns the strips of the image saved in the given PNG file that its framed payload is in,
+    and the number of channels of each of their pixels.
+    Only the rows of the header are read to find out if there is a framed payload, and then only the rows
+    of the payload (in as few strips as max_memory allows, reading a strip of the file has a cost of its own).
+    The rows of the payload are read as RGBA if it is hidden in the alpha channel too.
+    :raise framing.InvalidFrameError: If there is no framed payload in the image.
+    """
+    width, _ = png_stream.png_image_size(png_file_path)
+    header_rows = -(-framing.FRAME_HEADER_COLORS // (width * framing.NUM_OF_RGB_CHANNELS))
+    header = framing.read_frame_header(png_stream.iter_png_row_strips(png_file_path, header_rows))
+    num_of_channels = header.num_of_image_channels
+    row_size = width * num_of_channels
+    rows_per_strip = -(-header.num_of_colors() // row_size)
+    if max_memory:
+        rows_per_strip = min(rows_per_strip, max(max_memory // 2 // config.DECODE_MEMORY_PER_COLOR // row_size, 1))
+    mode = framing.COLOR_CHANNELS_NAMES[:num_of_channels]
+    return png_stream.iter_png_row_strips(png_file_path, rows_per_strip, mode), num_of_channels
+
+
+def decode_framed_png_file(png_file_path: str, max_memory: int = None, profile: DecodeProfile = NO_PROFILE) -> str:
+    """
+    This function returns the framed text that was hidden in the image saved in the given PNG file,
+    reading only the rows of the file it is in (see framed_png_file_strips).
+    :raise framing.InvalidFrameError: If there is no framed text in the image.
+    """
+    row_strips, num_of_channels = framed_png_file_strips(png_file_path, max_memory)
+    return decode_framed(row_strips, profile, num_of_channels)
 
 
-def decode(image_as_np_array: np.ndarray) -> str:
+def read_shard(png_file_path: str, max_memory: int = None) -> (int, bytes):
     """
-    This is the main logic function of decoding an image with hidden text in it.
-    It tries to find the best guess as if the text was hidden start from each byte in the image.
+    This function reads the shard that was hidden in the image saved in the given PNG file (see decode_shards).
+    :return: The flags of its header, and the shard.
+    :raise framing.InvalidFrameError: If there is no shard in the image.
     """
-    max_words = 0
-    best_guess = ''
-    for i in range(8):
-        symbols_of_channels = get_hidden_ascii_symbols_of_channels_from_image_as_np_array(image_as_np_array, i)
-        guess = guess_hidden_text(symbols_of_channels)
-        if len(guess.split(SPACE)) > max_words:
-            max_words = len(guess.split(SPACE))
-            best_guess = guess
-    return best_guess
+    header, shard = framing.read_frame(*framed_png_file_strips(png_file_path, max_memory))
+    if not header.flags & framing.FLAG_SHARD:
+        raise framing.InvalidFrameError(f"The image {png_file_path} holds a whole framed text, not a shard of one.")
+    return header.flags, shard
+
+
+def decode_shards(png_file_paths: [str], max_memory: int = None, workers: int = None) -> str:
+    """
+    This function returns the text that was split between the images saved in the given PNG files
+    (see steg_hide.hide_sharded), which may be given in any order.
+    The shard of each image is read over a pool of workers processes, if workers (more than 1) is given.
+    :raise framing.InvalidFrameError: If a shard is missing or corrupted, or the images hold shards of several texts.
+    """
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(png_file_paths))) as executor:
+            shards = list(executor.map(read_shard, png_file_paths, [max_memory] * len(png_file_paths)))
+    else:
+        shards = [read_shard(png_file_path, max_memory) for png_file_path in png_file_paths]
+    flags = {shard_flags for shard_flags, _ in shards}
+    if len(flags) != 1:
+        raise framing.InvalidFrameError("The shards were hidden with different flags, they aren't of a single text.")
+    payload = framing.join_shards([shard for _, shard in shards])
+    return framing.decompress_payload(payload, flags.pop()).decode('latin-1')
+
+
+def decode_png_file(png_file_path: str, max_memory: int = None, profile: DecodeProfile = NO_PROFILE,
+                    progressive: bool = True, workers: int = None, prerank: bool = True) -> str:
+    """
+    This function decodes the image saved in the given PNG file.
+    If max_memory (bytes) is given, the image is read from the file strip by strip,
+    so the whole image is never in memory, and the memory used is about max_memory bytes.
+
+    A framed text is read from the file first, only as far as it goes, so it is decoded without
+    reading the rest of the image.
+
+    If workers (more than 1) is given, the image is loaded right into a shared memory, and decoded over this
+    number of worker processes (see decode_shared_colors). Then max_memory bounds only the working memory
+    of decoding it.
+    """
+    try:
+        return decode_framed_png_file(png_file_path, max_memory, profile)
+    except framing.InvalidFrameError:
+        pass
+
+    if workers and workers > 1:
+        start_time = profile.clock()
+        with utils.open_png_image(png_file_path) as image:
+            width, height = image.size
+
+            def load_colors(colors: np.ndarray) -> None:
+                utils.copy_image_to_np_array(image, colors.reshape(height, width, framing.NUM_OF_RGB_CHANNELS))
+                profile.record('load', start_time, colors=colors.size)
+
+            return decode_with_workers(width * height * framing.NUM_OF_RGB_CHANNELS, load_colors, workers,
+                                       max_memory, profile, progressive, prerank)
+    if not max_memory:
+        start_time = profile.clock()
+        image_as_np_array = utils.png_file_to_np_array(png_file_path)[:, :, :framing.NUM_OF_RGB_CHANNELS]
+        profile.record('load', start_time, colors=image_as_np_array.size)
+        return decode(image_as_np_array, profile=profile, progressive=progressive, framed=False, prerank=prerank)
+    # Half of the memory is for reading the strip from the file, and half for decoding it
+    width, _ = png_stream.png_image_size(png_file_path)
+    rows_per_strip = max(max_memory // 2 // config.DECODE_MEMORY_PER_COLOR // (width * 3), 1)
+    return decode_strips(png_stream.iter_png_row_strips(png_file_path, rows_per_strip), profile, progressive,
+                         prerank)
 
 
 def main() -> None:
@@ -283,22 +964,102 @@ def main() -> None:
 
     parser.add_argument('--image',
                         type=str,
-                        help='Path of a PNG image with hidden text.',
+                        nargs='+',
+                        help='Path of a PNG image with hidden text (or - to read it from the standard input), '
+                             'or the paths of all the images a text was split between (in any order).',
                         required=True)
+    parser.add_argument('--output',
+                        type=str,
+                        help='Path of a TXT file to save the text in, or - to write it to the standard output '
+                             '(default: next to the image, or the standard output if the image is read from '
+                             'the standard input).')
+    parser.add_argument('--max-memory',
+                        type=utils.parse_memory_size,
+                        help='Decode the image strip by strip, using about this much memory (e.g. 512M, 2G).')
+    parser.add_argument('--wordlist',
+                        type=str,
+                        help='Path of a wordlist (TXT or compact dictionary file) to use instead of the '
+                             'most common English words.')
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Decode the image over this number of worker processes (up to 8, one for each offset), '
+                             'that share the memory of the image.')
+    parser.add_argument('--full-scan',
+                        action='store_true',
+                        help='Decode all of the image completely, instead of progressively (slower, same result).')
+    parser.add_argument('--exhaustive',
+                        action='store_true',
+                        help='Look for words in all of the image, instead of only in the parts that are scored '
+                             'as text (slower, finds texts shorter than 8 symbols too, that may be missed '
+                             'otherwise).')
+    parser.add_argument('--profile',
+                        type=str,
+                        help='Path of a JSON file to write the time and item counts of each stage of the decoding '
+                             '(for each offset and channel) to.')
+    parser.add_argument('--cprofile',
+                        type=str,
+                        help='Path of a file to write the cProfile stats of the decoding to.')
+    parser.add_argument('--tracemalloc',
+                        type=str,
+                        help='Path of a file to write a tracemalloc snapshot of the decoding (at its end) to.')
 
     args = parser.parse_args()
-    image_path = args.image
-
-    print(f'\nThe decoding process started. The time is: {datetime.now()}\n')
-    image_as_np_array = utils.png_file_to_rgb_np_array_converter(image_path)
-    hidden_text = decode(image_as_np_array)
-
-    decoded_image_path = utils.get_output_path(image_path, utils.Stage.DECODE)
-    with open(decoded_image_path, 'w') as f:
+    image_path = args.image[0]
+    if len(args.image) > 1 and utils.STANDARD_STREAM_PATH in args.image:
+        parser.error("Only a single image can be read from the standard input.")
+    if image_path == utils.STANDARD_STREAM_PATH and (args.max_memory or args.workers):
+        parser.error("--max-memory and --workers read the image from a file.")
+    output_path = args.output or utils.get_output_path(image_path, utils.Stage.DECODE)
+    # The text is written to the standard output, so the messages go to the standard error
+    to_stdout = output_path == utils.STANDARD_STREAM_PATH
+    messages = sys.stderr if to_stdout else sys.stdout
+    if args.wordlist:
+        dictionary.use_wordlist(args.wordlist)
+    profile = DecodeProfile() if args.profile else NO_PROFILE
+    profiler = cProfile.Profile() if args.cprofile else None
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    print(f'\nThe decoding process started. The time is: {datetime.now()}\n', file=messages)
+    if profiler:
+        profiler.enable()
+    try:
+        if len(args.image) > 1:
+            hidden_text = decode_shards(args.image, args.max_memory, args.workers)
+        elif image_path == utils.STANDARD_STREAM_PATH:
+            hidden_text = decode_bytes(sys.stdin.buffer.read(), profile, progressive=not args.full_scan,
+                                       prerank=not args.exhaustive)
+        else:
+            hidden_text = decode_png_file(image_path, args.max_memory, profile, progressive=not args.full_scan,
+                                          workers=args.workers, prerank=not args.exhaustive)
+    except (framing.ShardedPayloadError, framing.InvalidFrameError) as e:
+        # The images given are only some of the shards of a text, or not the shards of the same text
+        # (see decode_shards)
+        parser.error(str(e))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.cprofile)
+    if args.tracemalloc:
+        tracemalloc.take_snapshot().dump(args.tracemalloc)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'The peak memory traced was {peak} bytes, the snapshot was saved in {args.tracemalloc}', file=messages)
+    if args.profile:
+        with open(args.profile, 'w') as f:
+            json.dump(profile.to_dict(), f, indent=2)
+        print(f'The profile of the decoding was saved in {args.profile}', file=messages)
+
+    if to_stdout:
+        sys.stdout.write(hidden_text)
+        sys.stdout.flush()
+        print(f'The text was found successfully! The time is {datetime.now()}\n'
+              f'It was written to the standard output', file=messages)
+        return
+    with open(output_path, 'w') as f:
         f.write(hidden_text)
     print(f'The text was found successfully! The time is {datetime.now()}\n'
           f'\nThe text is: {hidden_text}\n'
-          f'And it was saved in {decoded_image_path}')
+          f'And it was saved in {output_path}')
 
 
 if __name__ == '__main__':
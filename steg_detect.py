@@ -0,0 +1,316 @@
+import argparse
+import json
+import math
+import sys
+
+import numpy as np
+
+import framing
+import steg_decode
+import utils
+from config import MAX_HIDE_CHANNELS, NUM_OF_BITS_IN_ASCII_SYMBOL
+
+# Payloads are hidden from the first color of the image, so the regions start from a strip of rows of at least
+# this number of colors (fewer colors are too few for the statistics of random payloads, which are fooled by
+# a small smooth area), and grow twice as big each time (like progressive decoding), so they aren't diluted
+FIRST_REGION_COLORS = 1 << 16
+# Bump when a change of the detection changes the probabilities it gives,
+# so the detections cached before aren't reused (see decode_cache.py)
+DETECTOR_VERSION = 1
+# Images that are at least this likely to carry a payload are flagged
+DEFAULT_DETECT_THRESHOLD = 0.5
+# Pairs of values with fewer colors than this (on average) are left out of the chi-square test
+MIN_CHI_SQUARE_PAIR_COLORS = 5
+# The probability of a random payload is at most the probability of the chi-square attack, so the (slower)
+# sample pairs analysis is run only where the chi-square attack gives at least this probability
+MIN_CHI_SQUARE_PROBABILITY = 0.01
+# The sample pairs analysis estimates an embedding rate of a few percents even in clean images, so a region counts
+# as carrying a random payload only from this rate, and certainly does from twice of it (see ramp_probability)
+MIN_SAMPLE_PAIRS_RATE = 0.1
+# Runs of symbols that look like text (see text_runs) in clean images and in noise are up to about 50 symbols long,
+# so a region counts as carrying a text only from a run of this length, and certainly does from twice of it
+MIN_TEXT_RUN_SYMBOLS = 64
+# The windows of the runs of text (see text_runs), longer than the ones of prerank, so runs in noise are rarer
+TEXT_WINDOW_SYMBOLS = 16
+TEXT_WINDOW_MIN_TEXT_SYMBOLS = 12
+NUM_OF_SYMBOL_VALUES = 1 << NUM_OF_BITS_IN_ASCII_SYMBOL
+# A sample pair (u, v) is counted by whether u < v, u = v or u > v, whether v is odd, and whether u and v differ only
+# in the LSB (see sample_pairs_rate)
+SAMPLE_PAIR_CLASSES = 3 * 2 * 2
+
+
+def region_row_bounds(height: int, row_colors: int, first_region_colors: int = FIRST_REGION_COLORS) -> [(int, int)]:
+    """
+    This function splits the rows of an image to regions: strips of whole rows, from a strip of at least
+    first_region_colors colors, that grow twice as big each time.
+    :return: The first row and the end row (exclusive) of each region.
+    """
+    bounds = []
+    first_row = 0
+    region_rows = max(-(-first_region_colors // max(row_colors, 1)), 1)
+    while first_row < height:
+        bounds.append((first_row, min(first_row + region_rows, height)))
+        first_row += region_rows
+        region_rows *= 2
+    return bounds
+
+
+def normal_survival(z: float) -> float:
+    """
+    This function returns the probability that a standard normal variable is bigger than z.
+    """
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def chi_square_survival(chi_square: float, degrees_of_freedom: int) -> float:
+    """
+    This function returns the probability that a chi-square variable (of the given degrees of freedom) is bigger than
+    the given value, by the Wilson-Hilferty approximation (the cube root of a chi-square variable is about normal),
+    which is accurate enough for the tens of degrees of freedom of the chi-square test.
+    """
+    if chi_square <= 0:
+        return 1.0
+    variance = 2 / (9 * degrees_of_freedom)
+    return normal_survival(((chi_square / degrees_of_freedom) ** (1 / 3) - (1 - variance)) / math.sqrt(variance))
+
+
+def chi_square_probability(histogram: np.ndarray) -> float:
+    """
+    This function runs the chi-square attack (pairs of values) on the given histogram of values.
+    Replacing the LSBs of values with random bits makes the two values of each pair (2k, 2k + 1) about equally
+    common, while in a clean image they usually aren't. The test measures how far the counts of the values
+    of each pair are from their average.
+    :return: The probability that the counts of the pairs are equal, which is high when the LSBs of the values
+    carry a random (e.g. compressed) payload, and about 0 otherwise.
+    """
+    histogram = histogram.astype(np.float64)
+    expected = (histogram[0::2] + histogram[1::2]) / 2
+    is_tested = expected >= MIN_CHI_SQUARE_PAIR_COLORS
+    degrees_of_freedom = np.count_nonzero(is_tested) - 1
+    if degrees_of_freedom < 1:
+        return 0.0
+    chi_square = np.sum((histogram[0::2][is_tested] - expected[is_tested]) ** 2 / expected[is_tested])
+    return chi_square_survival(float(chi_square), degrees_of_freedom)
+
+
+def sample_pairs_rate(values: np.ndarray) -> float:
+    """
+    This function runs the sample pairs analysis on the given values (rows x columns x colors),
+    and estimates the rate of the values whose LSB carries a random payload.
+    Each two horizontally adjacent values of the same color are a sample pair (u, v).
+    In a clean image, pairs with u < v are as common with an even v as with an odd v (and the same for u > v),
+    and replacing LSBs breaks it by an amount that is a quadratic function of the rate, which is solved for it:
+    (W + Z) / 2 * rate^2 + (2X - P) * rate + Y - X = 0, where P is the number of pairs, X of the pairs with
+    (v even and u < v) or (v odd and u > v), Y of the pairs with (v even and u > v) or (v odd and u < v),
+    Z of the pairs with u = v, and W of the pairs whose values differ only in the LSB.
+    The rate is estimated for each color separately, and the median of them is returned,
+    as a color of the image may have a histogram that biases it (the payload is spread over all the colors).
+    """
+    num_of_colors = values.shape[2]
+    left = values[:, :-1]
+    right = values[:, 1:]
+    if not left.size:
+        return 0.0
+    # Each pair is counted by its class: whether u < v, u = v or u > v, whether v is odd, and whether
+    # u and v differ only in the LSB, and by its color (all of them at once)
+    classes = (left > right).view(np.uint8) + (left >= right).view(np.uint8)
+    classes *= 2
+    classes += right & 1
+    classes *= 2
+    classes += (left ^ right) == 1
+    classes *= num_of_colors
+    classes += np.arange(num_of_colors, dtype=np.uint8)
+    counts = np.bincount(classes.reshape(-1), minlength=SAMPLE_PAIR_CLASSES * num_of_colors)
+    counts = counts.reshape(3, 2, 2, num_of_colors).astype(np.float64)
+    smaller, equal, bigger = counts
+    x = smaller[0].sum(axis=0) + bigger[1].sum(axis=0)
+    y = bigger[0].sum(axis=0) + smaller[1].sum(axis=0)
+    z = equal.sum(axis=(0, 1))
+    w = smaller[:, 1].sum(axis=0) + bigger[:, 1].sum(axis=0)
+    num_of_pairs = left.size // num_of_colors
+    a = (w + z) / 2
+    b = 2 * x - num_of_pairs
+    c = y - x
+    # The root of the smaller magnitude (the other one is about 1 or more)
+    discriminant = np.sqrt(np.maximum(b * b - 4 * a * c, 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roots = np.where(a > 0, (-b + np.where(b < 0, -discriminant, discriminant)) / (2 * np.where(a > 0, a, 1)),
+                         -c / np.where(b != 0, b, 1))
+    return float(np.median(roots))
+
+
+def text_runs(colors: np.ndarray) -> (int, int):
+    """
+    This function looks for hidden texts in the LSB channels of the colors, the way prerank of the decoding
+    does (see steg_decode.is_in_text_window): a text (even one that moves between the channels) covers a run of
+    consecutive symbol indices that are in windows that look like text, which in clean images and in noise are
+    short (tens of symbols), as such windows are rare and random there.
+    :return: The length of the longest run (from any of the 8 offsets), and the number of the symbol indices
+    in runs of at least MIN_TEXT_RUN_SYMBOLS (from the offset with the most of them).
+    """
+    longest_run = 0
+    text_symbols = 0
+    for symbols_of_channels in steg_decode.get_hidden_symbols_of_all_offsets(colors):
+        # The runs start and end where is_in_text_window changes
+        is_text = steg_decode.is_in_text_window(symbols_of_channels, TEXT_WINDOW_SYMBOLS, TEXT_WINDOW_MIN_TEXT_SYMBOLS)
+        bounds = np.flatnonzero(np.diff(is_text, prepend=False, append=False))
+        runs = bounds[1::2] - bounds[0::2]
+        if runs.size:
+            longest_run = max(longest_run, int(runs.max()))
+            text_symbols = max(text_symbols, int(runs[runs >= MIN_TEXT_RUN_SYMBOLS].sum()))
+    return longest_run, text_symbols
+
+
+def ramp_probability(value: float, min_value: float) -> float:
+    """
+    This function converts a statistic of a payload (an estimated rate of it, or a length of it) to the probability
+    that there is a payload: 0 up to min_value (which clean images have too), growing to 1 at twice of it.
+    """
+    return max(min(value / min_value - 1, 1.0), 0.0)
+
+
+def symbols_entropy_of_rows(colors_of_rows: np.ndarray) -> np.ndarray:
+    """
+    This function returns the entropy map of the LSB channels (bit planes): the Shannon entropy (in bits)
+    of the symbols of each LSB channel in each row (read from the first color of the row).
+    The symbols of a hidden text have an entropy of about 4 to 5 bits, a random payload and the noise of a clean
+    image have an entropy as high as the number of symbols of a row allows (up to 8 bits), and flat areas of an
+    image have an entropy of about 0.
+    :param colors_of_rows: The colors of the rows (rows x colors of a row).
+    :return: Array of shape (MAX_HIDE_CHANNELS, rows).
+    """
+    num_of_rows, row_colors = colors_of_rows.shape
+    num_of_symbols = row_colors // NUM_OF_BITS_IN_ASCII_SYMBOL
+    entropy = np.zeros((MAX_HIDE_CHANNELS, num_of_rows))
+    if not num_of_symbols:
+        return entropy
+    row_of_symbols = np.repeat(np.arange(num_of_rows) * NUM_OF_SYMBOL_VALUES, num_of_symbols)
+    for channel in range(MAX_HIDE_CHANNELS):
+        bits = (colors_of_rows[:, :num_of_symbols * NUM_OF_BITS_IN_ASCII_SYMBOL] >> channel) & 1
+        symbols = np.packbits(bits.reshape(num_of_rows, num_of_symbols, NUM_OF_BITS_IN_ASCII_SYMBOL), axis=2)
+        counts = np.bincount(row_of_symbols + symbols.reshape(-1), minlength=num_of_rows * NUM_OF_SYMBOL_VALUES)
+        probabilities = counts.reshape(num_of_rows, NUM_OF_SYMBOL_VALUES) / num_of_symbols
+        with np.errstate(divide='ignore', invalid='ignore'):
+            entropy[channel] = -np.sum(np.where(probabilities > 0, probabilities * np.log2(probabilities), 0), axis=1)
+    return entropy
+
+
+def detect(image_as_np_array: np.ndarray, entropy_map: bool = False) -> dict:
+    """
+    This function checks, in one pass over the image (region by region), how likely it is to carry a payload
+    hidden in the LSB channels (bit planes) of its colors, without decoding it.
+    The rows of the image are split to regions (see region_row_bounds), and each LSB channel of each region is
+    tested by the chi-square attack and the sample pairs analysis, that find random payloads (like compressed
+    texts). A random payload is found only when both of them agree, as each of them alone is fooled by some clean
+    images (e.g. the chi-square attack by smooth gradients). The bits of a text aren't random, so these tests
+    barely notice it, and each region is searched for runs of symbols that look like text too (see text_runs).
+
+    Images of noise look exactly like images that carry a random payload, so they are flagged too,
+    and texts shorter than about a hundred symbols may be missed.
+    A framed payload (see framing.py) is certainly found, with its exact length, by its header.
+
+    :param image_as_np_array: The image in its native mode (see utils.png_file_to_np_array).
+    :param entropy_map: Add the entropy of the symbols of each LSB channel in each row (see symbols_entropy_of_rows).
+    :return: A dict with the probability that the image carries a payload, a rough estimate of the payload's
+    length (bytes), whether it is framed, and the statistics of each region and channel.
+    """
+    try:
+        frame_header = framing.read_frame_header((image_as_np_array,), image_as_np_array.shape[2])
+    except framing.InvalidFrameError:
+        frame_header = None
+    image_as_np_array = image_as_np_array[:, :, :framing.NUM_OF_RGB_CHANNELS]
+    height, width, num_of_channels = image_as_np_array.shape
+    regions = []
+    rows_entropy = []
+    for first_row, end_row in region_row_bounds(height, width * num_of_channels):
+        values = image_as_np_array[first_row:end_row]
+        longest_text_run, text_symbols = text_runs(values)
+        histogram = np.bincount(values.reshape(-1), minlength=NUM_OF_SYMBOL_VALUES)
+        channels = []
+        for channel in range(MAX_HIDE_CHANNELS):
+            # The values of the LSB channel are the values without their lower bits, whose histogram is
+            # the sum of each 2 ** channel values of the histogram of the values
+            chi_square = chi_square_probability(histogram.reshape(-1, 1 << channel).sum(axis=1))
+            rate = None
+            if chi_square >= MIN_CHI_SQUARE_PROBABILITY:
+                rate = sample_pairs_rate(values >> channel if channel else values)
+            channels.append({'chi_square': chi_square, 'sample_pairs_rate': rate})
+        regions.append({'first_row': first_row, 'end_row': end_row, 'colors': int(values.size),
+                        'longest_text_run': longest_text_run, 'text_symbols': text_symbols, 'channels': channels})
+        if entropy_map:
+            rows_entropy.append(symbols_entropy_of_rows(values.reshape(end_row - first_row, -1)))
+
+    probability = 0.0
+    payload_bytes = 0
+    for region in regions:
+        region['text_probability'] = ramp_probability(region['longest_text_run'], MIN_TEXT_RUN_SYMBOLS)
+        probability = max(probability, region['text_probability'])
+        # Each color of an LSB channel with a random payload carries a bit of it
+        random_bits = 0.0
+        for stats in region['channels']:
+            if stats['sample_pairs_rate'] is None:
+                stats['random_probability'] = 0.0
+                continue
+            stats['random_probability'] = min(stats['chi_square'],
+                                              ramp_probability(stats['sample_pairs_rate'], MIN_SAMPLE_PAIRS_RATE))
+            probability = max(probability, stats['random_probability'])
+            if stats['random_probability'] >= DEFAULT_DETECT_THRESHOLD:
+                random_bits += min(stats['sample_pairs_rate'], 1) * region['colors']
+        text_symbols = region['text_symbols'] if region['text_probability'] >= DEFAULT_DETECT_THRESHOLD else 0
+        payload_bytes += max(text_symbols, int(random_bits) // NUM_OF_BITS_IN_ASCII_SYMBOL)
+
+    if frame_header is not None:
+        probability = 1.0
+        payload_bytes = frame_header.payload_length
+    result = {'probability': round(probability, 6), 'payload_bytes': payload_bytes,
+              'framed': frame_header is not None, 'regions': regions}
+    if entropy_map:
+        result['entropy_map'] = np.concatenate(rows_entropy, axis=1).round(3).tolist() if rows_entropy else []
+    return result
+
+
+def detect_png_file(png_file_path: str, entropy_map: bool = False) -> dict:
+    """
+    This function checks how likely the image saved in the given PNG file is to carry a hidden payload (see detect).
+    """
+    return detect(utils.png_file_to_np_array(png_file_path), entropy_map)
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program, and checks each image for a hidden payload.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--image',
+                        type=str,
+                        nargs='+',
+                        help='Paths of PNG images to check for a hidden payload.',
+                        required=True)
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=DEFAULT_DETECT_THRESHOLD,
+                        help='Flag the images that are at least this likely to carry a payload '
+                             f'(default: {DEFAULT_DETECT_THRESHOLD}).')
+    parser.add_argument('--details',
+                        action='store_true',
+                        help='Write the statistics of each region and LSB channel of each image too.')
+    parser.add_argument('--entropy-map',
+                        action='store_true',
+                        help='Write the entropy of the symbols of each LSB channel in each row of each image too.')
+
+    args = parser.parse_args()
+    flagged = 0
+    for image_path in args.image:
+        result = detect_png_file(image_path, args.entropy_map)
+        if not args.details:
+            del result['regions']
+        result = {'path': image_path, 'flagged': result['probability'] >= args.threshold, **result}
+        flagged += result['flagged']
+        print(json.dumps(result))
+    print(f"{flagged} of {len(args.image)} images were flagged.", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
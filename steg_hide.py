@@ -1,38 +1,355 @@
 import argparse
+import io
+import os
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 import numpy as np
+from PIL import Image
 
+import config
+import framing
+import png_stream
 import utils
-from config import NUM_OF_BITS_IN_ASCII_SYMBOL
+from config import MAX_HIDE_CHANNELS, NUM_OF_BITS_IN_ASCII_SYMBOL, TEXT_READ_CHUNK_SIZE
 
 
-def hide(image_path: str, text_to_hide: str) -> str:
+def text_to_bytes(text: str) -> bytes:
     """
-    This is the main logic function of hiding text in LSB channel of an image.
-    It converts the text to a list of uint-8 ascii representation of each letter,
-    and then hides the text in the Least Significant Bits of the image and saves it.
+    This function converts the text to the uint-8 ascii representation of each letter.
+    """
+    try:
+        return text.encode('latin-1')
+    except UnicodeEncodeError:
+        raise ValueError("The given text contains symbols that can't be represented as 8 bits ascii symbols.\n"
+                         "Try a text with ascii symbols only.") from None
+
+
+def bytes_to_bits(bytes_to_hide: bytes) -> np.ndarray:
+    """
+    This function unpacks the bytes (in one operation) to an array of bits, the most significant bit of each byte first.
+    """
+    return np.unpackbits(np.frombuffer(bytes_to_hide, dtype=np.uint8))
+
+
+def hide_values_in_colors(colors: np.ndarray, selector: slice or np.ndarray, values: np.ndarray,
+                          bits_per_color: int = 1) -> None:
+    """
+    This function writes the given values to the lowest bits_per_color bits of the selected colors, in place,
+    with whole-array operations instead of looping over the pixels.
+    """
+    low_bits_mask = np.uint8(~((1 << bits_per_color) - 1) & 0xFF)
+    if isinstance(selector, slice):
+        colors_to_change = colors[selector]
+        # Clear the lowest bits of each color, and then set them to the value we hide in it
+        colors_to_change &= low_bits_mask
+        colors_to_change |= values
+    else:
+        colors[selector] = colors[selector] & low_bits_mask | values
+
+
+class PayloadHider(object):
+
+    def __init__(self, payload_chunks: [bytes], header: framing.FrameHeader = None,
+                 num_of_channels: int = framing.NUM_OF_RGB_CHANNELS) -> None:
+        """
+        This class hides a payload in an image that is given strip by strip, in order (see hide_in_strip).
+        The payload is given chunk by chunk too, and each chunk is read only when the strip it is hidden in arrives,
+        so neither the whole image nor the whole payload has to be in memory.
+        :param payload_chunks: The bytes of the payload, in chunks of any size.
+        :param header: The header of the payload, if it is framed (see framing.py).
+        Then the payload is hidden in the layout the header describes, instead of the LSB of all the RGB colors.
+        :param num_of_channels: Number of channels of each pixel of the image (3 for RGB, 4 for RGBA).
+        """
+        self.payload_chunks = iter(payload_chunks)
+        self.pending_bits = np.empty(0, dtype=np.uint8)
+        self.header = header
+        self.header_bits = bytes_to_bits(header.to_bytes()) if header else None
+        self.num_of_channels = num_of_channels
+        # Index of the first color of the next strip, from the start of the image
+        self.first_color = 0
+        self.num_of_hidden_carriers = 0
+
+    def read_bits(self, num_of_bits: int) -> np.ndarray:
+        """
+        Returns the next num_of_bits bits of the payload (or fewer, if the payload ends before).
+        """
+        parts = [self.pending_bits]
+        num_of_read_bits = self.pending_bits.size
+        while num_of_read_bits < num_of_bits:
+            chunk = next(self.payload_chunks, None)
+            if chunk is None:
+                break
+            parts.append(bytes_to_bits(chunk))
+            num_of_read_bits += parts[-1].size
+        bits = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        self.pending_bits = bits[num_of_bits:]
+        return bits[:num_of_bits]
+
+    def hide_in_strip(self, row_strip: np.ndarray) -> None:
+        """
+        Hides the part of the payload that belongs in the next strip of the image, in place.
+        """
+        colors = row_strip.reshape(-1)
+        last_color = self.first_color + colors.size
+        if self.header is None:
+            # The payload is hidden in the LSB of all the RGB colors, from the first one
+            self.hide_carriers(colors, last_color, framing.RGB_COLOR_CHANNELS, 0, 1)
+        else:
+            # The header is hidden the same way, and the payload after it, in the layout the header describes
+            first_header_color = framing.num_of_colors_before(framing.RGB_COLOR_CHANNELS, self.num_of_channels, 0,
+                                                              self.first_color)
+            num_of_header_colors = framing.num_of_colors_before(framing.RGB_COLOR_CHANNELS, self.num_of_channels, 0,
+                                                                last_color) - first_header_color
+            header_bits = self.header_bits[first_header_color:first_header_color + num_of_header_colors]
+            hide_values_in_colors(colors, framing.colors_selector(framing.RGB_COLOR_CHANNELS, self.num_of_channels, 0,
+                                                                  first_header_color, header_bits.size,
+                                                                  self.first_color), header_bits)
+            self.hide_carriers(colors, last_color, self.header.color_channels,
+                               framing.first_carrier_color(self.num_of_channels), self.header.bits_per_channel)
+        self.first_color = last_color
+
+    def hide_carriers(self, colors: np.ndarray, last_color: int, color_channels: int, start: int,
+                      bits_per_channel: int) -> None:
+        """
+        Hides the next bits of the payload in the carriers of the strip (the colors of color_channels from the
+        color of index start on, see framing.colors_selector), bits_per_channel bits in each carrier.
+        """
+        last_carrier = framing.num_of_colors_before(color_channels, self.num_of_channels, start, last_color)
+        bits = self.read_bits((last_carrier - self.num_of_hidden_carriers) * bits_per_channel)
+        values = framing.bits_to_carrier_values(bits, bits_per_channel)
+        selector = framing.colors_selector(color_channels, self.num_of_channels, start, self.num_of_hidden_carriers,
+                                           values.size, self.first_color)
+        hide_values_in_colors(colors, selector, values, bits_per_channel)
+        self.num_of_hidden_carriers += values.size
+
+
+def payload_layout(framed: bool, bits_per_channel: int, color_channels: str) -> (bool, int):
+    """
+    This function validates the layout the payload is hidden in.
+    :return: Whether the payload is framed, and the bit mask of the color channels.
+    The payload is always framed if it isn't hidden in the LSB of all the RGB colors,
+    so the decoder knows where it is.
     """
-    image_as_np_array = utils.png_file_to_rgb_np_array_converter(image_path)
-    if image_as_np_array.size < len(text_to_hide) * 8:
+    if not 1 <= bits_per_channel <= MAX_HIDE_CHANNELS:
+        raise ValueError(f"The number of bits per channel must be between 1 and {MAX_HIDE_CHANNELS}.")
+    color_channels_mask = framing.parse_color_channels(color_channels)
+    framed = framed or bits_per_channel != 1 or color_channels_mask != framing.RGB_COLOR_CHANNELS
+    return framed, color_channels_mask
+
+
+def num_of_needed_colors(payload_length: int, header: framing.FrameHeader, num_of_channels: int) -> int:
+    """
+    This function returns the number of colors from the start of the image to the end of the payload,
+    in an image with num_of_channels channels of each pixel.
+    :raise ValueError: If the payload is hidden in the alpha channel, and the image has none.
+    """
+    if header is None:
+        return framing.colors_span(framing.RGB_COLOR_CHANNELS, num_of_channels, 0,
+                                   payload_length * NUM_OF_BITS_IN_ASCII_SYMBOL)
+    if header.num_of_image_channels > num_of_channels:
+        raise ValueError("The given image has no alpha channel to hide the text in.\n"
+                         "Try an RGBA image, or only the RGB channels.")
+    return header.num_of_colors(num_of_channels)
+
+
+def check_capacity(image_size: int, num_of_colors: int) -> None:
+    if image_size < num_of_colors:
         raise ValueError("The given text is too long for the given image.\n"
                          "Try a shorter text, or a bigger image.")
-    ascii_values_of_chars = [ord(char) for char in text_to_hide]
-    bits_to_hide = ''.join([f'{val:0{NUM_OF_BITS_IN_ASCII_SYMBOL}b}' for val in ascii_values_of_chars])
-    for line_num, line in enumerate(image_as_np_array):
-        for column_num, column in enumerate(line):
-            # looping over all RGB values in image
-            rgb_value = image_as_np_array[line_num][column_num]
-            for color_index, color_value in enumerate(rgb_value):
-                if bits_to_hide == '':
-                    new_name = utils.get_output_path(image_path, utils.Stage.HIDE)
-                    utils.np_array_to_png_file_converter(np.array(image_as_np_array), new_name)
-                    return new_name
-                bit_to_hide = bits_to_hide[0]
-                bits_to_hide = bits_to_hide[1:]
-                image_as_np_array[line_num][column_num][color_index] = utils.set_bit(
-                    image_as_np_array[line_num][column_num][color_index], int(bit_to_hide), 0)
-    raise Exception("Unexpected error occurred.")
+
+
+def hide(image_path: str, text_to_hide: str, output_path: str = None, framed: bool = False,
+         bits_per_channel: int = 1, color_channels: str = 'RGB', compression: str = None) -> str:
+    """
+    This is the main logic function of hiding text in LSB channel of an image.
+    It converts the text to the bits of the uint-8 ascii representation of each letter,
+    and then hides the bits in the Least Significant Bits of the image and saves it.
+    The image is saved in output_path, or next to the original image if it isn't given
+    (both the image and output_path may be file objects too, e.g. io.BytesIO, then output_path must be given).
+
+    The image is loaded in its native mode (see utils.open_png_image), and only its rows the text is hidden in
+    are copied to a np array, so the memory used is about the size of the image once.
+    RGBA images are saved as RGBA, with their alpha channel.
+
+    If framed, a header with the length and the checksum of the text is hidden before it (see framing.py),
+    so the decoder reads exactly the text, instead of guessing it (and the text doesn't have to be English).
+    :param bits_per_channel: Number of the lowest bits of each color to hide the text in (1-3),
+    more bits hide a longer text in the same image.
+    :param color_channels: The colors of each pixel to hide the text in, some of 'RGB', or of 'RGBA' in RGBA images.
+    The text is always framed if it isn't hidden in the LSB of all the RGB colors, so the decoder knows where it is.
+    :param compression: 'zlib' or 'lzma' to compress the text before hiding it (it is framed then), so fewer colors
+    are changed, a longer text fits in the same image, and fewer colors are read to decode it.
+    """
+    flags = framing.compression_flags(compression)
+    framed, color_channels_mask = payload_layout(framed or bool(flags), bits_per_channel, color_channels)
+    bytes_to_hide = b''.join(framing.compress_payload_chunks((text_to_bytes(text_to_hide),), flags))
+    header = framing.payload_header(bytes_to_hide, flags, bits_per_channel, color_channels_mask) if framed else None
+    return hide_payload(image_path, bytes_to_hide, header, output_path)
+
+
+def hide_bytes(image: bytes or np.ndarray, text_to_hide: str, framed: bool = False, bits_per_channel: int = 1,
+               color_channels: str = 'RGB', compression: str = None) -> bytes:
+    """
+    This function hides the text in an image in memory, without reading or writing any file (see hide),
+    e.g. an image that was received over the network or through a pipe.
+    :param image: The bytes of a PNG file (bytes, bytearray or memoryview), a file object of it,
+    or the image itself as a np array of RGB (or RGBA) values.
+    :return: The bytes of the PNG file of the new image.
+    """
+    output = io.BytesIO()
+    hide(image, text_to_hide, output, framed, bits_per_channel, color_channels, compression)
+    return output.getvalue()
+
+
+def hide_payload(image_path: str, bytes_to_hide: bytes, header: framing.FrameHeader = None,
+                 output_path: str = None) -> str:
+    """
+    This function hides the bytes in the image (framed by the header, if it is given), and saves it (see hide).
+    """
+    with utils.open_png_image(image_path) as image:
+        width, height = image.size
+        num_of_channels = len(image.getbands())
+        num_of_colors = num_of_needed_colors(len(bytes_to_hide), header, num_of_channels)
+        check_capacity(width * height * num_of_channels, num_of_colors)
+        num_of_rows = max(-(-num_of_colors // (width * num_of_channels)), 1)
+        rows_to_hide_in = np.array(image.crop((0, 0, width, num_of_rows)))
+        PayloadHider((bytes_to_hide,), header, num_of_channels).hide_in_strip(rows_to_hide_in)
+        image.paste(Image.fromarray(rows_to_hide_in, mode=image.mode), (0, 0))
+        new_name = output_path or utils.get_output_path(image_path, utils.Stage.HIDE)
+        image.save(new_name, format='PNG')
+    return new_name
+
+
+def payload_capacity(image_path: str, bits_per_channel: int = 1,
+                     color_channels_mask: int = framing.RGB_COLOR_CHANNELS) -> int:
+    """
+    This function returns the number of bytes of the longest framed payload that can be hidden in the image
+    saved in the given PNG file, in the given layout (only the header of the file is read).
+    :raise ValueError: If the payload is hidden in the alpha channel, and the image has none.
+    """
+    with Image.open(image_path) as image:
+        (width, height), num_of_channels = image.size, len(utils.native_mode(image))
+    if color_channels_mask & framing.ALPHA_COLOR_CHANNEL and num_of_channels == framing.NUM_OF_RGB_CHANNELS:
+        raise ValueError(f"The image {image_path} has no alpha channel to hide the text in.\n"
+                         "Try RGBA images, or only the RGB channels.")
+    num_of_carriers = framing.num_of_colors_before(color_channels_mask, num_of_channels,
+                                                   framing.first_carrier_color(num_of_channels),
+                                                   width * height * num_of_channels)
+    return num_of_carriers * bits_per_channel // NUM_OF_BITS_IN_ASCII_SYMBOL
+
+
+def shard_sizes(payload_length: int, capacities: [int]) -> [int]:
+    """
+    This function divides the payload between the images in proportion to the number of bytes each of them
+    can hold (after the header of its shard), so all of them take about the same time to hide in.
+    """
+    if min(capacities) < framing.SHARD_HEADER.size:
+        raise ValueError("One of the given images is too small to hide even the header of a shard in.")
+    capacities = [capacity - framing.SHARD_HEADER.size for capacity in capacities]
+    if payload_length > sum(capacities):
+        raise ValueError("The given text is too long for the given images.\n"
+                         "Try a shorter text, or more or bigger images.")
+    sizes = [capacity * payload_length // max(sum(capacities), 1) for capacity in capacities]
+    # The sizes are rounded down, what is left goes to the first images that have room for it
+    left = payload_length - sum(sizes)
+    for i, capacity in enumerate(capacities):
+        extra = min(left, capacity - sizes[i])
+        sizes[i] += extra
+        left -= extra
+    return sizes
+
+
+def hide_sharded(image_paths: [str], text_to_hide: str, output_paths: [str] = None, bits_per_channel: int = 1,
+                 color_channels: str = 'RGB', compression: str = None, workers: int = None) -> [str]:
+    """
+    This function hides a text that is too long for one image in several images: the text (compressed, if a
+    compression is given) is split to a shard for each image (see framing.split_payload), and each shard is
+    hidden framed in its image, over a pool of worker processes.
+    The text is decoded back from all the new images together, in any order (see steg_decode.decode_shards).
+    :param output_paths: The paths to save the new images in (next to the original images if not given).
+    :return: The paths the new images were saved in.
+    """
+    flags = framing.compression_flags(compression) | framing.FLAG_SHARD
+    _, color_channels_mask = payload_layout(True, bits_per_channel, color_channels)
+    payload = b''.join(framing.compress_payload_chunks((text_to_bytes(text_to_hide),), flags))
+    capacities = [payload_capacity(image_path, bits_per_channel, color_channels_mask) for image_path in image_paths]
+    shards = framing.split_payload(payload, shard_sizes(len(payload), capacities))
+    output_paths = output_paths or [utils.get_output_path(image_path, utils.Stage.HIDE) for image_path in image_paths]
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(shards))) as executor:
+        futures = [executor.submit(hide_payload, image_path, shard,
+                                   framing.payload_header(shard, flags, bits_per_channel, color_channels_mask),
+                                   output_path)
+                   for image_path, shard, output_path in zip(image_paths, shards, output_paths)]
+        return [future.result() for future in futures]
+
+
+def open_text_file(text_path: str):
+    """
+    This function opens the TXT file of the text we want to hide, or the standard input if the path is '-'
+    (it isn't closed with the returned file object then).
+    """
+    if text_path == utils.STANDARD_STREAM_PATH:
+        return open(sys.stdin.fileno(), 'r', closefd=False)
+    return open(text_path, 'r')
+
+
+def read_text_file(text_path: str) -> str:
+    """
+    This function reads the text we want to hide from a TXT file (without the new lines).
+    """
+    with open_text_file(text_path) as file:
+        return file.read().replace('\n', '')
+
+
+def iter_text_file_bytes(text_path: str) -> bytes:
+    """
+    This function yields the text we want to hide from a TXT file (without the new lines) as bytes,
+    TEXT_READ_CHUNK_SIZE symbols at a time, the same bytes text_to_bytes(read_text_file(text_path)) returns.
+    """
+    with open_text_file(text_path) as file:
+        while True:
+            chunk = file.read(TEXT_READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield text_to_bytes(chunk.replace('\n', ''))
+
+
+def hide_text_file_streaming(image_path: str, text_path: str, max_memory: int, output_path: str = None,
+                             framed: bool = False, bits_per_channel: int = 1, color_channels: str = 'RGB',
+                             compression: str = None) -> str:
+    """
+    This function hides the text of a TXT file in the image saved in the given PNG file, like hide,
+    but with about max_memory bytes of memory, whatever the sizes of the image and the text are:
+    the text is read chunk by chunk, and the image is read, hidden in, and written to the new PNG file
+    strip by strip (so it is saved with the filters of png_stream.PngWriter, not the ones Pillow chooses).
+    """
+    flags = framing.compression_flags(compression)
+    framed, color_channels_mask = payload_layout(framed or bool(flags), bits_per_channel, color_channels)
+    # The text is read (and compressed) twice: once for its length (and checksum), and once to hide it
+    payload_length, payload_crc = 0, 0
+    for chunk in framing.compress_payload_chunks(iter_text_file_bytes(text_path), flags):
+        payload_length += len(chunk)
+        payload_crc = zlib.crc32(chunk, payload_crc)
+    header = framing.FrameHeader(payload_length, payload_crc, flags, bits_per_channel,
+                                 color_channels_mask) if framed else None
+    with Image.open(image_path) as image:
+        (width, height), mode = image.size, utils.native_mode(image)
+    row_size = width * len(mode)
+    check_capacity(row_size * height, num_of_needed_colors(payload_length, header, len(mode)))
+
+    rows_per_strip = max(max_memory // config.HIDE_MEMORY_PER_COLOR // row_size, 1)
+    hider = PayloadHider(framing.compress_payload_chunks(iter_text_file_bytes(text_path), flags), header, len(mode))
+    new_name = output_path or utils.get_output_path(image_path, utils.Stage.HIDE)
+    with png_stream.PngWriter(new_name, width, height, mode) as writer:
+        for row_strip in png_stream.iter_png_row_strips(image_path, rows_per_strip, mode):
+            # The strip is hidden in in place
+            row_strip = np.require(row_strip, requirements='W')
+            hider.hide_in_strip(row_strip)
+            writer.write_rows(row_strip)
+    return new_name
 
 
 def main() -> None:
@@ -44,25 +361,90 @@ def main() -> None:
 
     parser.add_argument('--image',
                         type=str,
-                        help='Path of a PNG image.',
+                        nargs='+',
+                        help='Path of a PNG image, or - to read it from the standard input. '
+                             'Given several images, the text is split between them '
+                             '(it is always framed then), and all of them are needed to decode it.',
                         required=True)
     parser.add_argument('--text',
                         type=str,
-                        help='Path of a TXT file that contains the text you want to hide.',
+                        help='Path of a TXT file that contains the text you want to hide, '
+                             'or - to read it from the standard input.',
                         required=True)
+    parser.add_argument('--output',
+                        type=str,
+                        help='Path to save the new image in, or - to write it to the standard output '
+                             '(default: next to the image, or the standard output if the image is read from '
+                             'the standard input).')
+    parser.add_argument('--framed',
+                        action='store_true',
+                        help='Hide a header with the length and the checksum of the text before it, '
+                             'so it is decoded exactly and fast (the text may be in any language).')
+    parser.add_argument('--bits-per-channel',
+                        type=int,
+                        choices=range(1, MAX_HIDE_CHANNELS + 1),
+                        default=1,
+                        help='Number of the lowest bits of each color to hide the text in (default: 1). '
+                             'More bits hide a longer text, the text is always framed with more than 1.')
+    parser.add_argument('--channels',
+                        type=str,
+                        default='RGB',
+                        help='The colors of each pixel to hide the text in, e.g. RB, or RGBA to hide in the alpha '
+                             'channel of RGBA images too (default: RGB). '
+                             'The text is always framed with other colors than RGB.')
+    parser.add_argument('--compress',
+                        type=str,
+                        choices=list(framing.COMPRESSION_FLAGS),
+                        help='Compress the text before hiding it (it is always framed then), '
+                             'so a longer text fits in the image and it is changed less.')
+    parser.add_argument('--max-memory',
+                        type=utils.parse_memory_size,
+                        help='Read the text in chunks, and hide it in the image strip by strip, '
+                             'using about this much memory (e.g. 512M, 2G).')
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of worker processes to hide the text in several images over '
+                             '(default: number of CPUs).')
 
     args = parser.parse_args()
     text_path = args.text
-    image_path = args.image
-
-    print(f"\nThe hiding process started. The time is: {datetime.now()}\n")
-    with open(text_path, 'r') as file:
-        text = file.read().replace('\n', '')
+    if len(args.image) > 1 and args.max_memory:
+        parser.error("--max-memory hides the text in a single image.")
+    if len(args.image) > 1 and (args.output or utils.STANDARD_STREAM_PATH in args.image):
+        parser.error("--output and - are of a single image, the new images are saved next to the images.")
+    image_path = args.image[0]
+    output_path = args.output or utils.get_output_path(image_path, utils.Stage.HIDE)
+    if args.max_memory and utils.STANDARD_STREAM_PATH in (image_path, text_path, output_path):
+        parser.error("--max-memory reads the image and the text (twice) from files, and saves the new image in a file.")
+    if image_path == text_path == utils.STANDARD_STREAM_PATH:
+        parser.error("Only one of the image and the text can be read from the standard input.")
+    # The new image is written to the standard output, so the messages go to the standard error
+    to_stdout = output_path == utils.STANDARD_STREAM_PATH
+    messages = sys.stderr if to_stdout else sys.stdout
 
-    new_path = hide(image_path, text)
-    print(f"The hiding process finished. The time is: {datetime.now()}\n")
+    print(f"\nThe hiding process started. The time is: {datetime.now()}\n", file=messages)
+    if len(args.image) > 1:
+        new_paths = hide_sharded(args.image, read_text_file(text_path), bits_per_channel=args.bits_per_channel,
+                                 color_channels=args.channels, compression=args.compress, workers=args.workers)
+        new_path = ', '.join(new_paths)
+    elif args.max_memory:
+        new_path = hide_text_file_streaming(image_path, text_path, args.max_memory, output_path, framed=args.framed,
+                                            bits_per_channel=args.bits_per_channel, color_channels=args.channels,
+                                            compression=args.compress)
+    else:
+        text = read_text_file(text_path)
+        if image_path == utils.STANDARD_STREAM_PATH:
+            image_path = io.BytesIO(sys.stdin.buffer.read())
+        new_path = hide(image_path, text, io.BytesIO() if to_stdout else output_path, framed=args.framed,
+                        bits_per_channel=args.bits_per_channel, color_channels=args.channels,
+                        compression=args.compress)
+        if to_stdout:
+            sys.stdout.buffer.write(new_path.getvalue())
+            sys.stdout.buffer.flush()
+            new_path = 'the standard output'
+    print(f"The hiding process finished. The time is: {datetime.now()}\n", file=messages)
     print(f'The text was hidden successfully in the image!\n'
-          f'It was saved in {new_path}')
+          f'It was saved in {new_path}', file=messages)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+import argparse
+import base64
+import json
+import os
+import socketserver
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import UnidentifiedImageError
+
+import dictionary
+import framing
+import png_stream
+import steg_decode
+import steg_hide
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Requests with a bigger body are rejected, before reading it
+MAX_REQUEST_SIZE = 1 << 30
+# Errors of a request that are the fault of the request (reported as 400), and not of the server (500)
+REQUEST_ERRORS = (ValueError, KeyError, TypeError, UnidentifiedImageError, png_stream.UnsupportedPngError,
+                  framing.ShardedPayloadError)
+
+
+def warm_up_worker(wordlist_path: str = None) -> None:
+    """
+    This function runs once in each worker process when it starts, so the first request it gets doesn't pay
+    for loading the dictionary and building the lookup tables of the decoding.
+    """
+    if wordlist_path:
+        dictionary.use_wordlist(wordlist_path)
+    steg_decode.decode(np.zeros((8, 8, framing.NUM_OF_RGB_CHANNELS), dtype=np.uint8), framed=False)
+
+
+def run_decode_request(image_bytes: bytes, progressive: bool = True, prerank: bool = True) -> dict:
+    """
+    This function decodes a PNG image given as bytes, in a worker process of the pool
+    (see steg_decode.decode_bytes).
+    """
+    return {'text': steg_decode.decode_bytes(image_bytes, progressive=progressive, prerank=prerank)}
+
+
+def run_hide_request(image_bytes: bytes, text: str, framed: bool = False, bits_per_channel: int = 1,
+                     color_channels: str = 'RGB', compression: str = None) -> dict:
+    """
+    This function hides the text in a PNG image given as bytes, in a worker process of the pool.
+    :return: The new PNG image, base64 encoded.
+    """
+    new_image = steg_hide.hide_bytes(image_bytes, text, framed, bits_per_channel, color_channels, compression)
+    return {'image': base64.b64encode(new_image).decode('ascii')}
+
+
+class StegRequestHandler(BaseHTTPRequestHandler):
+    """
+    This class handles the requests of the server:
+    POST /decode with a JSON body {"image": <base64 PNG>, "full_scan": false, "exhaustive": false},
+    returns {"text": ...}.
+    POST /hide with a JSON body {"image": <base64 PNG>, "text": ..., "framed": false, "bits_per_channel": 1,
+    "channels": "RGB", "compression": null}, returns {"image": <base64 PNG>}.
+    GET /health returns {"status": "ok"}.
+    Failed requests return {"error": ...}.
+    """
+
+    def do_GET(self) -> None:
+        if self.path != '/health':
+            self.send_json(404, {'error': f"Unknown path {self.path}."})
+            return
+        self.send_json(200, {'status': 'ok'})
+
+    def do_POST(self) -> None:
+        if self.path not in ('/decode', '/hide'):
+            self.send_json(404, {'error': f"Unknown path {self.path}."})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_REQUEST_SIZE:
+            self.send_json(413, {'error': f"The request is bigger than {MAX_REQUEST_SIZE} bytes."})
+            return
+        try:
+            request = json.loads(self.rfile.read(length))
+            image_bytes = base64.b64decode(request['image'], validate=True)
+            if self.path == '/decode':
+                future = self.server.executor.submit(run_decode_request, image_bytes,
+                                                     not request.get('full_scan', False),
+                                                     not request.get('exhaustive', False))
+            else:
+                future = self.server.executor.submit(run_hide_request, image_bytes, request['text'],
+                                                     request.get('framed', False),
+                                                     request.get('bits_per_channel', 1),
+                                                     request.get('channels', 'RGB'),
+                                                     request.get('compression'))
+            response = future.result()
+        except REQUEST_ERRORS as e:
+            self.send_json(400, {'error': f"{type(e).__name__}: {e}"})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': f"{type(e).__name__}: {e}"})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def start_workers(workers: int, wordlist_path: str = None) -> ProcessPoolExecutor:
+    """
+    This function starts the pool of worker processes, and waits until all of them are warmed up
+    (see warm_up_worker), so even the first requests are fast.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=warm_up_worker, initargs=(wordlist_path,))
+    for future in [executor.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    return executor
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, unix_socket: str = None, workers: int = None,
+          wordlist_path: str = None) -> None:
+    """
+    This function runs the server until it is interrupted: on a local HTTP port, or on a Unix socket if given.
+    The requests are handled in threads, and decoded or hidden over a pool of worker processes,
+    that live as long as the server, so they are started and warmed up only once.
+    """
+    workers = workers or os.cpu_count() or 1
+    executor = start_workers(workers, wordlist_path)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, StegRequestHandler)
+        address = unix_socket
+    else:
+        server = ThreadingHTTPServer((host, port), StegRequestHandler)
+        address = f"http://{host}:{server.server_port}"
+    server.executor = executor
+    print(f"The server is listening on {address} with {workers} workers. The time is: {datetime.now()}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+    print(f"The server stopped. The time is: {datetime.now()}")
+
+
+def main() -> None:
+    """
+    The main function
+    It gets arguments from the user while running the program and runs the server.
+    """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--host',
+                        type=str,
+                        default=DEFAULT_HOST,
+                        help=f'Host to listen on (default: {DEFAULT_HOST}).')
+    parser.add_argument('--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help=f'Port to listen on (default: {DEFAULT_PORT}).')
+    parser.add_argument('--unix-socket',
+                        type=str,
+                        help='Path of a Unix socket to listen on, instead of a port.')
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of worker processes (default: number of CPUs).')
+    parser.add_argument('--wordlist',
+                        type=str,
+                        help='Path of a wordlist (TXT or compact dictionary file) to use instead of the '
+                             'most common English words.')
+
+    args = parser.parse_args()
+    if args.unix_socket and not hasattr(socketserver, 'UnixStreamServer'):
+        sys.exit("Unix sockets are not supported on this platform.")
+    serve(args.host, args.port, args.unix_socket, args.workers, args.wordlist)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,25 @@
+import io
 from enum import Enum
 
 import numpy as np
 from PIL import Image
 
+# Images are copied from Pillow to np arrays in strips of this number of colors
+LOAD_STRIP_COLORS = 1 << 22
+# The path of the standard input (or output) in the command line, e.g. to pipe an image through the programs
+STANDARD_STREAM_PATH = '-'
+
+
+def png_file_object(png_file: str or bytes or memoryview):
+    """
+    This function returns a file object of a PNG image that is given as bytes, bytearray or memoryview
+    (e.g. an image that was received over the network), so it is read from memory, without saving it to disk first.
+    Paths and file objects are returned as they are.
+    """
+    if isinstance(png_file, (bytes, bytearray, memoryview)):
+        return io.BytesIO(png_file)
+    return png_file
+
 
 def png_file_to_rgb_np_array_converter(png_file_path: str) -> np.ndarray:
     """
@@ -28,14 +45,68 @@ def png_file_to_rgb_np_array_converter(png_file_path: str) -> np.ndarray:
        ...   ,   ...  , ...
        ...   ,   ...  , ...]
 
-    :param png_file_path: The full path to the file we want to convert.
+    :param png_file_path: The full path to the file we want to convert (or a file object, or the bytes of the file).
     :return: The given image as a np array of RGB values
     """
-    with Image.open(png_file_path) as image:
+    with Image.open(png_file_object(png_file_path)) as image:
         np_array = np.array(image.convert(mode='RGB'))
     return np_array
 
 
+def native_mode(image: Image.Image) -> str:
+    """
+    This function returns the mode an image is hidden in and decoded with: RGBA if it has an alpha channel
+    (so the alpha channel is kept, and may be hidden in too), RGB otherwise.
+    """
+    return 'RGBA' if 'A' in image.getbands() else 'RGB'
+
+
+def open_png_image(png_file_path: str) -> Image.Image:
+    """
+    This function loads the image saved in the given png file (a path, a file object or the bytes of the file,
+    see png_file_object) in its native mode (see native_mode), converting it only if it isn't already in this mode
+    (e.g. grayscale or palette images), instead of always converting it to RGB, which copies the whole image.
+    An image that is already a np array (height x width x 3 RGB, or 4 RGBA, values) is given as it is too.
+    """
+    if isinstance(png_file_path, np.ndarray):
+        return Image.fromarray(png_file_path, mode='RGBA' if png_file_path.shape[-1] == 4 else 'RGB')
+    image = Image.open(png_file_object(png_file_path))
+    mode = native_mode(image)
+    if image.mode == mode:
+        image.load()
+        return image
+    with image:
+        return image.convert(mode=mode)
+
+
+def png_file_to_np_array(png_file_path: str) -> np.ndarray:
+    """
+    This function returns the image saved in the given png file (see open_png_image) as a np array
+    of its native mode (height x width x 3 RGB, or 4 RGBA, values).
+    The array is filled from the decoded image strip by strip, instead of converting all of the image
+    to bytes at once (as np.array(image) does), so the memory used is about the size of the image twice.
+    """
+    with open_png_image(png_file_path) as image:
+        width, height = image.size
+        np_array = np.empty((height, width, len(image.getbands())), dtype=np.uint8)
+        copy_image_to_np_array(image, np_array)
+    return np_array
+
+
+def copy_image_to_np_array(image: Image.Image, np_array: np.ndarray) -> None:
+    """
+    This function copies the image to the given np array (height x width x channels) strip by strip,
+    e.g. to an array of a shared memory. If the array has fewer channels than the image (e.g. RGB of an
+    RGBA image), only its first channels are copied.
+    """
+    width, height = image.size
+    num_of_channels = np_array.shape[2]
+    rows_per_strip = max(LOAD_STRIP_COLORS // np_array[0].size, 1)
+    for first_row in range(0, height, rows_per_strip):
+        last_row = min(first_row + rows_per_strip, height)
+        np_array[first_row:last_row] = np.asarray(image.crop((0, first_row, width, last_row)))[:, :, :num_of_channels]
+
+
 def np_array_to_png_file_converter(np_array: np.ndarray, path_to_save_png_file: str) -> None:
     """
     This function gets a np array, converts it to an RGB image, and saves it as a png file.
@@ -58,13 +129,16 @@ def np_array_to_png_file_converter(np_array: np.ndarray, path_to_save_png_file:
        ...   ,   ...  , ...
        ...   ,   ...  , ...]
 
-    and saves it as a png file in the given path.
+    and saves it as a png file in the given path (or file object, e.g. io.BytesIO).
+
+    An array of RGBA values (with a fourth channel) is saved as an RGBA image.
 
     :param np_array: The np array we want to convert to an image.
     :param path_to_save_png_file: Path for saving the image.
     :return: None
     """
-    Image.fromarray(np_array, mode='RGB').save(path_to_save_png_file)
+    mode = 'RGBA' if np_array.shape[-1] == 4 else 'RGB'
+    Image.fromarray(np_array, mode=mode).save(path_to_save_png_file, format='PNG')
 
 
 def set_bit(value: int, bit_to_set: int, bit_index: int) -> int:
@@ -87,6 +161,12 @@ class Stage(Enum):
 
 
 def get_output_path(image_path: str, stage: Stage) -> str:
+    """
+    This function returns the path of the output of a stage, next to the image it is of.
+    The output of an image that is read from the standard input is written to the standard output.
+    """
+    if image_path == STANDARD_STREAM_PATH:
+        return STANDARD_STREAM_PATH
     extension = {Stage.HIDE: "_hidden.png",
                  Stage.DECODE: "_decoded.txt"}
 
@@ -94,3 +174,14 @@ def get_output_path(image_path: str, stage: Stage) -> str:
         image_path = image_path[0:-4]
 
     return f"{image_path}{extension[stage]}"
+
+
+def parse_memory_size(size: str) -> int:
+    """
+    This function converts a memory size given by the user (e.g. 1048576, 512K, 64M, 2G) to bytes.
+    """
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)